@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_key(*parts):
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode()).hexdigest()
+
+class Cache:
+    """
+    Content-addressed store of results under <cache_dir>/<key[:2]>/<key>
+
+    Entries are written atomically, so several processes can share a cache.
+    Reading an entry updates its modification time, and evict() removes the
+    least recently used entries until the cache is at most max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        os.utime(self.path(key))
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", 'wb') as fout:
+            fout.write(data)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def get_file(self, key, output_file):
+        try:
+            shutil.copyfile(self.path(key), f"{output_file}.tmp")
+        except FileNotFoundError:
+            return False
+        os.replace(f"{output_file}.tmp", output_file)
+        os.utime(self.path(key))
+        return True
+
+    def put_file(self, key, input_file):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(input_file, f"{path}.{os.getpid()}.tmp")
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def evict(self):
+        if self.max_size is None or not os.path.isdir(self.cache_dir):
+            return 0
+        entries = []
+        for directory in os.scandir(self.cache_dir):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size; removed += 1
+        return removed
+
+class LabelStore:
+    """
+    sqlite3 table of classifier labels of k-mers, keyed by a hash of their sequence
+
+    Labels are shared across accessions and experiments; the classifier key
+    keeps the labels of different classifiers, settings and modes apart.
+    """
+
+    def __init__(self, path, classifier):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS labels (classifier TEXT, kmer BLOB, label INTEGER, "
+                                "PRIMARY KEY (classifier, kmer)) WITHOUT ROWID")
+        self.classifier = classifier
+
+    def get(self, kmers, chunk_size=500):
+        kmers = list(kmers)
+        labels = {}
+        for i in range(0, len(kmers), chunk_size):
+            chunk = kmers[i:i+chunk_size]
+            query = f"SELECT kmer, label FROM labels WHERE classifier = ? AND kmer IN ({','.join('?' * len(chunk))})"
+            labels.update((kmer, bool(label)) for kmer, label in self.connection.execute(query, [self.classifier] + chunk))
+        return labels
+
+    def put(self, labels):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?)",
+                                        ((self.classifier, kmer, int(label)) for kmer, label in labels.items()))
+
+    def close(self):
+        self.connection.close()
@@ -1,14 +1,66 @@
 import sys
 import argparse
 import os
+import numpy as np
+from bisect import bisect_right
 
-def extract_sequence(fasta_file):
-    sequence = ""
-    with open(fasta_file) as file:
-        for line in file:
-            if not line.startswith('>'):
-                sequence += line.strip()
-    return sequence
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrumentation import Report
+from parsers import read_fasta
+
+def read_kmers(fasta_file):
+    # Headers and total sequence length of a k-mer Fasta file
+    headers = []; length = 0
+    for header, sequence in read_fasta(fasta_file):
+        headers.append(header); length += len(sequence)
+    return headers, length
+
+def largest_island(classified):
+    # Longest run of unclassified k-mers, wrapping around the end of the circular sequence
+    positions = np.flatnonzero(classified)
+    if len(positions) == 0:
+        return len(classified)
+    return int((np.diff(positions, append=positions[0] + len(classified)) - 1).max())
+
+def summary_header(k, mode):
+    return f"{mode}_ID\tlength_(bp)\t#{k}-mers\t#{mode}_{k}-mers\tlargest_non-{mode}_island_(#{k}-mers)\n"
+
+def evaluate_results(accession, fasta_file, platon_file, report=None):
+    if report is None:
+        report = Report("EXP1_assembled_plasmids/evaluate_results.py")
+    with report.stage('parse'):
+        headers, length = read_kmers(fasta_file)
+        platon_headers, _ = read_kmers(platon_file)
+    
+    with report.stage('compare'):
+        # Platon keeps the headers of the k-mers it classified, in order; each one is matched
+        # to the next k-mer with that header, so repeated headers are labeled copy by copy
+        positions = {}
+        for i, header in enumerate(headers):
+            positions.setdefault(header, []).append(i)
+        classified = np.zeros(len(headers), dtype=bool); pos = -1
+        for header in platon_headers:
+            occurrences = positions.get(header, ())
+            j = bisect_right(occurrences, pos)
+            if j == len(occurrences):
+                break
+            pos = occurrences[j]; classified[pos] = True
+        largest_island_length = largest_island(classified)
+    
+    report.count('kmers', len(headers))
+    report.count('platon_kmers', len(platon_headers))
+    
+    return f"{accession}\t{length}\t{len(headers)}\t{len(platon_headers)}\t{largest_island_length}\n"
+
+def evaluate_accessions(accessions, fasta_files, platon_files, report=None):
+    # Evaluate all accessions of an experiment in one process; yields (accession, row, error)
+    if report is None:
+        report = Report("EXP1_assembled_plasmids/evaluate_results.py")
+    for accession, fasta_file, platon_file in zip(accessions, fasta_files, platon_files):
+        try:
+            yield accession, evaluate_results(accession, fasta_file, platon_file, report), None
+        except OSError as error:
+            yield accession, None, str(error)
 
 def main():
     parser = argparse.ArgumentParser(description="Create a summary of Platon results for one sample.")
@@ -20,15 +72,23 @@ def main():
     parser.add_argument("-p", "--platon_file", help="Path to the Platon Fasta file")
     parser.add_argument("-o", "--output_file", help="Path to the Output table file")
     parser.add_argument("-m", "--mode", help="Expect 'plasmid' or 'chromosome' sequences")
+  ##
+    # All accessions of an experiment at once (instead of -a, -f and -p)
+    parser.add_argument("-l", "--accessions", help="Path to an accession list; evaluates <kmer_dir>/<accession>.fasta against <platon_dir>/<accession>.<mode>.fasta")
+    parser.add_argument("--kmer_dir", default="kmers", help="Directory of the k-mer Fasta files")
+    parser.add_argument("--platon_dir", default="platon", help="Directory of the Platon output")
   ##
     # Optional arguments
     parser.add_argument("-k", type=int, default=5, help="Number of consecutive genes per k-mer")
+    parser.add_argument("--report", help="Path to a JSON report of stage times, peak memory and counters to write")
+    parser.add_argument("--profile", help="Path to a cProfile dump of the run to write")
   ##
     args = parser.parse_args()
     
-    if not args.fasta_file or not args.platon_file or not args.output_file:
+    if not args.output_file or not args.accessions and (not args.fasta_file or not args.platon_file):
         print("Error: Missing required arguments.")
         print("Usage: parser.py -f <fasta_file> -p <platon_file> -o <output_file> [options]")
+        print("       parser.py -l <accessions_file> -o <output_file> [options]")
         exit(1)
     
     if not args.mode:
@@ -37,64 +97,31 @@ def main():
         exit(1)
     
     k = args.k; mode = args.mode
+    report = Report("EXP1_assembled_plasmids/evaluate_results.py", args, profile=bool(args.profile))
     if not os.path.exists(args.output_file):
         output_file = open(args.output_file, 'w')
-        output_file.write(f"{mode}_ID\tlength_(bp)\t#{k}-mers\t#{mode}_{k}-mers\tlargest_non-{mode}_island_(#{k}-mers)\n")
+        output_file.write(summary_header(k, mode))
         output_file.close()
     
-    sequence = extract_sequence(args.fasta_file)
-    length = len(sequence)
-    
-    platon_file = open(args.platon_file)
-    fasta_file = open(args.fasta_file)
-    
-    num_platon_kmers = 0
-    num_fasta_kmers = 0
-    
-    initial_island_length = 0
-    current_island_length = 0
-    largest_island_length = 0
-    
-    for platon_line in platon_file:
-        if platon_line.startswith('>'):
-            num_platon_kmers += 1
-            
-            for fasta_line in fasta_file:
-                if fasta_line.startswith('>'):
-                    num_fasta_kmers += 1
-                    
-                    if platon_line != fasta_line:
-                        initial_island_length += 1
-                    else:
-                        break
-            break
-    
-    for platon_line in platon_file:
-        if platon_line.startswith('>'):
-            num_platon_kmers += 1
-            
-            for fasta_line in fasta_file:
-                if fasta_line.startswith('>'):
-                    num_fasta_kmers += 1
-                    
-                    if platon_line != fasta_line:
-                        current_island_length += 1
-                    else:
-                        largest_island_length = max(current_island_length, largest_island_length)
-                        current_island_length = 0
-                        break
-    
-    for fasta_line in fasta_file:
-        if fasta_line.startswith('>'):
-            num_fasta_kmers += 1
-            
-            initial_island_length += 1
-    largest_island_length = max(initial_island_length, largest_island_length)
+    if args.accessions:
+        with open(args.accessions) as file:
+            accessions = [line.strip() for line in file if line.strip()]
+        fasta_files = [os.path.join(args.kmer_dir, f"{accession}.fasta") for accession in accessions]
+        platon_files = [os.path.join(args.platon_dir, f"{accession}.{mode}.fasta") for accession in accessions]
+        rows = []
+        for accession, row, error in evaluate_accessions(accessions, fasta_files, platon_files, report):
+            if row is None:
+                print(f"{accession} Error: {error}", file=sys.stderr)
+                report.count('failed')
+            else:
+                rows.append(row)
+    else:
+        rows = [evaluate_results(args.accession, args.fasta_file, args.platon_file, report)]
     
     output_file = open(args.output_file, 'a')
-    output_file.write(f"{args.accession}\t{length}\t{num_fasta_kmers}\t{num_platon_kmers}\t{largest_island_length}\n")
+    output_file.writelines(rows)
     output_file.close()
+    report.finish(args.report, args.profile)
 
 if __name__ == "__main__":
     main()
-
@@ -1,87 +1,63 @@
-import sys
+import sys, os
 import argparse
 import statistics
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrumentation import Report
+from parsers import read_fasta, read_genbank_features
 
 def extract_sequence(fasta_file):
-    sequence = ""
-    with open(fasta_file) as file:
-        for line in file:
-            if not line.startswith('>'):
-                sequence += line.strip()
-    return sequence
+    return b''.join(sequence for _, sequence in read_fasta(fasta_file)).decode()
 
-global_start = None; global_end = None
 def extract_genes(genbank_file):
-    global global_start; global global_end
-    
-    genes = []
-    with open(genbank_file) as file:
-        for line in file:
-            if line.startswith("FEATURES"):
-                break
-        for line in file:
-            if line.startswith("     source"):
-                coords = line.strip().split()[1].split("..")
-                global_start = int(coords[0])-1; global_end = int(coords[-1])
-                break
+    # Genes and the bounds of the source feature (None without one); the
+    # bounds are returned, not kept in globals, since pool workers reuse
+    # the module for many accessions
+    global_start = None; global_end = None
+    genes = []; source = False
+    for key, location, qualifiers in read_genbank_features(genbank_file):
+        if key == "source" and not source:
+            coords = location.split("..")
+            global_start = int(coords[0])-1; global_end = int(coords[-1])
+            source = True
         
-        for line in file:
-            if line.startswith("     gene"):
-                coords = line.strip().split()[1]
-                
-                if coords.startswith("complement"):
-                      coords = coords[11:-1]
-                      orientation = "-"
-                else: orientation = "+"
-                
-                if coords.startswith("join"):
-                      coords = coords[5:-1]
-                coords = coords.split("..")
-                
-                if coords[0].startswith("<") or coords[1].startswith(">"):
-                    continue
-                start = int(coords[0].split(",")[0])-1; end = int(coords[-1].split(",")[-1])
-                
-                if start < end:
-                      length = end - start
-                else: length = (global_end - start) + (end - global_start)
-                
-                if length < 150:
-                    continue
-                
-                name = None
-                for subline in file:
-                    if subline.startswith("                     /locus_tag"):
-                        name = subline.strip().split("=")[1][1:-1]
-                        break
-                
-                genes.append({"name": name, "start": start, "end": end, "length": length, "orientation": orientation})
-    return genes
+        elif key == "gene" and source:
+            coords = location
+            
+            if coords.startswith("complement"):
+                  coords = coords[11:-1]
+                  orientation = "-"
+            else: orientation = "+"
+            
+            if coords.startswith("join"):
+                  coords = coords[5:-1]
+            coords = coords.split("..")
+            
+            if coords[0].startswith("<") or coords[1].startswith(">"):
+                continue
+            start = int(coords[0].split(",")[0])-1; end = int(coords[-1].split(",")[-1])
+            
+            if start < end:
+                  length = end - start
+            else: length = (global_end - start) + (end - global_start)
+            
+            if length < 150:
+                continue
+            
+            name = qualifiers.get("locus_tag")
+            genes.append({"name": name, "start": start, "end": end, "length": length, "orientation": orientation})
+    return genes, global_start, global_end
 
-def main():
-    parser = argparse.ArgumentParser(description="Extract gene k-mers from a Fasta+GenBank file.")
-  ##
-    # File path arguments (required within the script)
-    parser.add_argument("-f", "--fasta_file", help="Path to the Fasta file")
-    parser.add_argument("-g", "--genbank_file", help="Path to the GenBank file")
-    parser.add_argument("-o", "--output_file", help="Path to the Output file")
-  ##
-    # Optional arguments
-    parser.add_argument("-k", type=int, default=5, help="Number of consecutive genes per k-mer")
-    parser.add_argument("-i", action='store_true', default=False, help="Include gaps between genes in output")
-  ##
-    args = parser.parse_args()
-    
-    if not args.fasta_file or not args.genbank_file or not args.output_file:
-        print("Error: Missing required arguments.")
-        print("Usage: parser.py -f <fasta_file> -g <genbank_file> -o <output_file> [options]")
-        exit(1)
-    
-    sequence = extract_sequence(args.fasta_file)
-    gene_list = extract_genes(args.genbank_file)
+def extract_kmers(fasta_file, genbank_file, output_file, k=5, i=False, report=None):
+    if report is None:
+        report = Report("EXP1_assembled_plasmids/extract_kmers.py")
+    with report.stage('parse'):
+        sequence = extract_sequence(fasta_file)
+        gene_list, global_start, global_end = extract_genes(genbank_file)
+    report.count('genes', len(gene_list))
     if global_start != 0 or global_end != len(sequence):
-        print("Error: GenBank+FASTA file mismatch in length.")
-        exit(1)
+        raise ValueError("GenBank+FASTA file mismatch in length.")
     
     #print()
     #for gene in gene_list:
@@ -123,36 +99,66 @@ def main():
     #print(f"    - stdev: {int(statistics.stdev(gap_lengths))}")
     
     #print()
-    k = args.k; i = args.i
     if k > len(gene_list):
-        print("Error: Not enough gene records for a k-mer.")
-        exit(1)
+        raise ValueError("Not enough gene records for a k-mer.")
     
-    with open(args.output_file, "w") as file:
-        if i:
-            for pos in range(1-k, len(gene_list)-k+1):
-                name = ""
-                for q in range(k):
-                    name += f'={gene_list[pos+q]["name"]}'
-                
-                start = gene_list[pos]["start"]
-                end = gene_list[pos+k-1]["end"]
-                if start <= end: kmer = sequence[start:end]
-                else:            kmer = sequence[start:] + sequence[:end]
-                
-                file.write(f">{name[1:]}\n{kmer}\n")
-        else:
-            for pos in range(1-k, len(gene_list)-k+1):
-                name = ""; kmer = ""
-                for q in range(k):
-                    name += f'|{gene_list[pos+q]["name"]}'
+    with report.stage('write'):
+        with open(output_file, "w") as file:
+            if i:
+                for pos in range(1-k, len(gene_list)-k+1):
+                    name = ""
+                    for q in range(k):
+                        name += f'={gene_list[pos+q]["name"]}'
+                    
+                    start = gene_list[pos]["start"]
+                    end = gene_list[pos+k-1]["end"]
+                    if start <= end: kmer = sequence[start:end]
+                    else:            kmer = sequence[start:] + sequence[:end]
                     
-                    start = gene_list[pos+q]["start"]
-                    end = gene_list[pos+q]["end"]
-                    if start <= end: kmer += sequence[start:end]
-                    else:            kmer += sequence[start:] + sequence[:end]
+                    file.write(f">{name[1:]}\n{kmer}\n")
+            else:
+                for pos in range(1-k, len(gene_list)-k+1):
+                    name = ""; kmer = ""
+                    for q in range(k):
+                        name += f'|{gene_list[pos+q]["name"]}'
+                        
+                        start = gene_list[pos+q]["start"]
+                        end = gene_list[pos+q]["end"]
+                        if start <= end: kmer += sequence[start:end]
+                        else:            kmer += sequence[start:] + sequence[:end]
                     
-                file.write(f">{name[1:]}\n{kmer}\n")
+                    file.write(f">{name[1:]}\n{kmer}\n")
+    report.count('kmers', len(gene_list))
+    return len(gene_list)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract gene k-mers from a Fasta+GenBank file.")
+  ##
+    # File path arguments (required within the script)
+    parser.add_argument("-f", "--fasta_file", help="Path to the Fasta file (may be gzip/bgzip-compressed)")
+    parser.add_argument("-g", "--genbank_file", help="Path to the GenBank file (may be gzip/bgzip-compressed)")
+    parser.add_argument("-o", "--output_file", help="Path to the Output file")
+  ##
+    # Optional arguments
+    parser.add_argument("-k", type=int, default=5, help="Number of consecutive genes per k-mer")
+    parser.add_argument("-i", action='store_true', default=False, help="Include gaps between genes in output")
+    parser.add_argument("--report", help="Path to a JSON report of stage times, peak memory and counters to write")
+    parser.add_argument("--profile", help="Path to a cProfile dump of the run to write")
+  ##
+    args = parser.parse_args()
+    
+    if not args.fasta_file or not args.genbank_file or not args.output_file:
+        print("Error: Missing required arguments.")
+        print("Usage: parser.py -f <fasta_file> -g <genbank_file> -o <output_file> [options]")
+        exit(1)
+    
+    report = Report("EXP1_assembled_plasmids/extract_kmers.py", args, profile=bool(args.profile))
+    try:
+        extract_kmers(args.fasta_file, args.genbank_file, args.output_file, args.k, args.i, report)
+    except (ValueError, EOFError, zlib.error) as error:
+        print(f"Error: {error}")
+        exit(1)
+    report.finish(args.report, args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,288 @@
+import sys, os
+import argparse
+import hashlib
+import shlex
+import subprocess
+import zlib
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrumentation import Report
+from extract_kmers import extract_kmers
+from evaluate_results import evaluate_accessions, summary_header
+from cache import Cache, LabelStore, file_digest, make_key
+from parsers import read_fasta
+
+PLATON_COMMAND = "{platon} {input} --output {output} --threads {threads}"
+
+def read_accessions(accessions_file):
+    with open(accessions_file) as file:
+        return [line.strip() for line in file if line.strip()]
+
+def data_path(args, accession, extension):
+    # <accession>.<extension>, or its gzip/bgzip-compressed version
+    path = os.path.join(args.data_dir, f"{accession}.{extension}")
+    return path if os.path.exists(path) or not os.path.exists(f"{path}.gz") else f"{path}.gz"
+
+def kmer_path(args, accession):
+    return os.path.join(args.kmer_dir, f"{accession}.fasta")
+
+def platon_path(args, accession):
+    return os.path.join(args.platon_dir, f"{accession}.{args.mode}.fasta")
+
+def open_cache(args):
+    return Cache(args.cache, args.cache_size) if args.cache else None
+
+def row_key(args, kmer_file):
+    # The row depends only on the k-mers and the classifier
+    return make_key("row", file_digest(kmer_file), args.mode, args.classifier, args.platon, args.platon_args)
+
+def prepare_accession(task):
+    accession, args = task
+    fasta_file = data_path(args, accession, "fasta")
+    genbank_file = data_path(args, accession, "gb")
+    kmer_file = kmer_path(args, accession)
+    cache = open_cache(args)
+    
+    try:
+        # The k-mers depend on the input files, k and -i
+        if cache:
+            kmer_key = make_key("kmers", file_digest(fasta_file), file_digest(genbank_file), args.k, args.i)
+        if not cache or not cache.get_file(kmer_key, kmer_file):
+            extract_kmers(fasta_file, genbank_file, kmer_file, args.k, args.i)
+            if cache:
+                cache.put_file(kmer_key, kmer_file)
+        
+        if cache:
+            values = cache.get(row_key(args, kmer_file))
+            if values is not None:
+                return accession, f"{accession}\t{values.decode()}", None
+        return accession, None, None
+    except (ValueError, OSError, EOFError, zlib.error) as error:
+        return accession, None, str(error)
+
+def classify(task):
+    # One classifier run, which writes <output_dir>/<input name>.<mode>.fasta
+    input_file, output_dir, threads, args = task
+    command = shlex.split(args.classifier.format(platon=args.platon, input=input_file, output=output_dir, threads=threads))
+    try:
+        subprocess.run(command + shlex.split(args.platon_args), check=True, stdout=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as error:
+        return str(error)
+    return None
+
+def classify_all(tasks, runs):
+    # Errors of all classifier runs in order; each run loads the full
+    # database, so at most runs (--platon_runs) run at once
+    with ThreadPool(max(1, min(runs, len(tasks)))) as run_pool:
+        yield from run_pool.imap(classify, tasks)
+
+def write_record(fout, header, sequence):
+    fout.write(f">{header}\n".encode()); fout.write(sequence); fout.write(b"\n")
+
+def write_batch(args, batch_file, accessions):
+    # Headers are namespaced as >accession|header so the output can be split again
+    with open(batch_file, 'wb') as fout:
+        for accession in accessions:
+            for header, sequence in read_fasta(kmer_path(args, accession)):
+                write_record(fout, f"{accession}|{header}", sequence)
+
+def split_batch(args, batch_output, accessions):
+    # Every accession of the batch gets an output file, even if nothing was classified
+    files = {accession: open(platon_path(args, accession), 'wb') for accession in accessions}
+    try:
+        for header, sequence in read_fasta(batch_output):
+            accession, header = header.split('|', 1)
+            write_record(files[accession], header, sequence)
+    finally:
+        for fout in files.values():
+            fout.close()
+
+def kmer_digest(sequence):
+    return hashlib.sha256(bytes(sequence).upper()).digest()
+
+def classify_new_kmers(args, accessions, report):
+    # Only k-mers whose sequence is not in the store yet are classified, split
+    # over one query file per concurrent Platon run (--platon_runs); the output
+    # of every accession is then written from the stored labels
+    store = LabelStore(args.store, make_key(args.mode, args.classifier, args.platon, args.platon_args))
+    query_dir = os.path.join(args.platon_dir, "store")
+    os.makedirs(query_dir, exist_ok=True)
+    runs = max(1, args.platon_runs)
+    query_files = [open(os.path.join(query_dir, f"query_{n}.fasta"), 'wb') for n in range(runs)]
+    
+    errors = {}; kmers = {}; labels = {}; new = set(); chunks = [[] for _ in range(runs)]
+    for accession in accessions:
+        try:
+            records = [(kmer_digest(sequence), sequence) for _, sequence in read_fasta(kmer_path(args, accession))]
+        except OSError as error:
+            errors[accession] = str(error)
+            continue
+        kmers[accession] = [digest for digest, _ in records]
+        labels.update(store.get({digest for digest, _ in records if digest not in labels and digest not in new}))
+        for digest, sequence in records:
+            if digest not in labels and digest not in new:
+                n = len(new) % runs
+                new.add(digest); chunks[n].append(digest)
+                write_record(query_files[n], digest.hex(), sequence)
+    for fout in query_files:
+        fout.close()
+    report.count('kmers', sum(len(digests) for digests in kmers.values()))
+    report.count('new_kmers', len(new))
+    
+    queries = list(range(min(runs, len(new))))
+    threads = args.platon_threads or max(1, (os.cpu_count() or 1) // max(1, len(queries)))
+    tasks = [(os.path.join(query_dir, f"query_{n}.fasta"), query_dir, threads, args) for n in queries]
+    failed = {}
+    for n, error in zip(queries, classify_all(tasks, runs)):
+        chunk = dict.fromkeys(chunks[n], False)
+        if error is None:
+            try:
+                for header, _ in read_fasta(os.path.join(query_dir, f"query_{n}.{args.mode}.fasta")):
+                    chunk[bytes.fromhex(header.split()[0])] = True
+            except (OSError, ValueError) as read_error:
+                error = f"Cannot read query {n}: {read_error}"
+        if error is None:
+            store.put(chunk)
+            labels.update(chunk)
+        else:
+            failed.update((digest, error) for digest in chunk)
+    store.close()
+    
+    for accession, digests in kmers.items():
+        error = next((failed[digest] for digest in digests if digest in failed), None)
+        if error is not None:
+            errors[accession] = error
+            continue
+        with open(platon_path(args, accession), 'wb') as fout:
+            for header, sequence in read_fasta(kmer_path(args, accession)):
+                if labels[kmer_digest(sequence)]:
+                    write_record(fout, header, sequence)
+    return errors
+
+def classify_accessions(args, accessions, report):
+    # One classifier run per accession, or per batch of accessions; returns the errors
+    if args.store:
+        return classify_new_kmers(args, accessions, report)
+    
+    errors = {}
+    if not args.batch_size:
+        runs = max(1, min(args.platon_runs, len(accessions)))
+        threads = args.platon_threads or max(1, (os.cpu_count() or 1) // runs)
+        tasks = [(kmer_path(args, accession), args.platon_dir, threads, args) for accession in accessions]
+        for accession, error in zip(accessions, classify_all(tasks, runs)):
+            if error is not None:
+                errors[accession] = error
+        return errors
+    
+    batch_dir = os.path.join(args.platon_dir, "batches")
+    os.makedirs(batch_dir, exist_ok=True)
+    batches = [accessions[i:i+args.batch_size] for i in range(0, len(accessions), args.batch_size)]
+    runs = max(1, min(args.platon_runs, len(batches)))
+    threads = args.platon_threads or max(1, (os.cpu_count() or 1) // runs)
+    
+    tasks = []
+    for n, batch in enumerate(batches):
+        batch_file = os.path.join(batch_dir, f"batch_{n}.fasta")
+        write_batch(args, batch_file, batch)
+        tasks.append((batch_file, batch_dir, threads, args))
+    
+    for n, (batch, error) in enumerate(zip(batches, classify_all(tasks, runs))):
+        if error is None:
+            try:
+                split_batch(args, os.path.join(batch_dir, f"batch_{n}.{args.mode}.fasta"), batch)
+            except (OSError, ValueError, KeyError) as split_error:
+                error = f"Cannot split batch {n}: {split_error}"
+        if error is not None:
+            errors.update((accession, error) for accession in batch)
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract k-mers, run Platon and summarize the results for all accessions.")
+  ##
+    # File path arguments
+    parser.add_argument("-a", "--accessions", default="accessions.txt", help="Path to the accession list")
+    parser.add_argument("-d", "--data_dir", default="data", help="Directory with <accession>.fasta and <accession>.gb files (or .fasta.gz and .gb.gz)")
+    parser.add_argument("-o", "--kmer_dir", default="kmers", help="Directory for the k-mer Fasta files")
+    parser.add_argument("-p", "--platon_dir", default="platon", help="Directory for the Platon output")
+    parser.add_argument("-s", "--summary_file", default="summary.tsv", help="Path to the Output table file")
+    parser.add_argument("-m", "--mode", default="plasmid", help="Expect 'plasmid' or 'chromosome' sequences")
+  ##
+    # Optional arguments
+    parser.add_argument("-k", type=int, default=5, help="Number of consecutive genes per k-mer")
+    parser.add_argument("-i", action='store_true', default=False, help="Include gaps between genes in output")
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count(), help="Number of accessions processed in parallel")
+    parser.add_argument("-b", "--batch_size", type=int, default=0, help="Classify the k-mers of this many accessions in one Platon run (default: one run per accession)")
+    parser.add_argument("--platon", default="platon", help="Path to the Platon executable")
+    parser.add_argument("--platon_threads", type=int, help="Threads per Platon run (default: CPUs / parallel runs)")
+    parser.add_argument("--platon_runs", type=int, default=1, help="Number of concurrent Platon runs; each run loads the full database")
+    parser.add_argument("--platon_args", default="", help="Extra arguments for Platon")
+    parser.add_argument("--classifier", default=PLATON_COMMAND, help="Classifier command with {platon}, {input}, {output} and {threads} fields; "
+                        "it must write <output>/<input name>.<mode>.fasta (default: '%(default)s')")
+    parser.add_argument("--store", help="Path to a sqlite3 store of k-mer labels shared across accessions and experiments; only k-mers not in it are classified")
+    parser.add_argument("-c", "--cache", help="Directory of a cache of k-mer Fasta files and summary rows; unchanged accessions are not recomputed")
+    parser.add_argument("--cache_size", type=float, default=1024, help="Maximum cache size in MB (least recently used entries are evicted)")
+    parser.add_argument("--report", help="Path to a JSON report of stage times, peak memory and counters to write")
+  ##
+    args = parser.parse_args()
+    
+    if args.mode not in ("plasmid", "chromosome"):
+        print("Error: Please specify expected sequence type.")
+        print("       --mode plasmid  or  --mode chromosome")
+        exit(1)
+    args.cache_size = int(args.cache_size * 2**20)
+    
+    report = Report("EXP1_assembled_plasmids/run_experiment.py", args)
+    accessions = read_accessions(args.accessions)
+    os.makedirs(args.kmer_dir, exist_ok=True)
+    os.makedirs(args.platon_dir, exist_ok=True)
+    
+    # Results come back in accession order, so the summary is the same for any number of threads
+    rows = {}; errors = {}
+    with Pool(args.threads) as pool:
+        with report.stage('extract'):
+            for accession, row, error in pool.imap(prepare_accession, [(accession, args) for accession in accessions]):
+                if error is not None:
+                    errors[accession] = error
+                elif row is not None:
+                    rows[accession] = row
+    report.count('cached', len(rows))
+    
+    pending = [accession for accession in accessions if accession not in rows and accession not in errors]
+    with report.stage('classify', batch_size=args.batch_size):
+        errors.update(classify_accessions(args, pending, report))
+    
+    # Evaluation is cheap, so all accessions are evaluated in one pass in this process
+    pending = [accession for accession in pending if accession not in errors]
+    cache = open_cache(args)
+    with report.stage('evaluate'):
+        kmer_files = [kmer_path(args, accession) for accession in pending]
+        platon_files = [platon_path(args, accession) for accession in pending]
+        for accession, row, error in evaluate_accessions(pending, kmer_files, platon_files):
+            if error is not None:
+                errors[accession] = error
+                continue
+            rows[accession] = row
+            if cache:
+                cache.put(row_key(args, kmer_path(args, accession)), row.split('\t', 1)[1].encode())
+    
+    for accession in accessions:
+        if accession in errors:
+            print(f"{accession} Error: {errors[accession]}", file=sys.stderr)
+            report.count('failed')
+        else:
+            print(accession, file=sys.stderr)
+    report.count('accessions', len(rows))
+    
+    with open(f"{args.summary_file}.tmp", 'w') as output_file:
+        output_file.write(summary_header(args.k, args.mode))
+        output_file.writelines(rows[accession] for accession in accessions if accession in rows)
+    os.replace(f"{args.summary_file}.tmp", args.summary_file)
+    
+    if args.cache:
+        report.count('evicted', Cache(args.cache, args.cache_size).evict())
+    report.finish(args.report)
+
+if __name__ == "__main__":
+    main()
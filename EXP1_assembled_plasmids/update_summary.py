@@ -4,11 +4,13 @@
 """
 Updating the summary files by adding BioSample, BioProject and Read accession ID
 
-Usage: python update_summary.py <plasmids_accession_file> <summary_file> <data_dir> <updated_summary_file>
+Usage: python update_summary.py <plasmids_accession_file> <summary_file> <data_dir> <updated_summary_file> [-t threads] [-c cache_dir]
        plamids_accession_file: file containing the plasmids accession IDs
        summary_file: initial TSV summary file
        data_dir: directory wih GenBank files, one per plasmid
        updated_summary_file: generated summary file with additional columns recording BioSampe, BioProject, Reads
+       threads: number of processes reading GenBank files (default: 1)
+       cache_dir: directory caching the DBLINK entries of each GenBank file, shared by runs on several summary files
 
 """
 
@@ -21,7 +23,13 @@ Usage: python update_summary.py <plasmids_accession_file> <summary_file> <data_d
 import sys
 import os
 import csv
-from Bio import GenBank
+import json
+import argparse
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parsers import read_genbank_dblinks
+from cache import Cache, make_key
 
 def read_accession_file(in_accession_file):
     """
@@ -41,23 +49,59 @@ def read_accession_file(in_accession_file):
 
 def read_dblink_from_genbank_file(in_gb_file):
     """
-    Read a GenBank file and extracts the DBLINK entries
+    Read the header of a GenBank file and extracts the DBLINK entries;
+    the file is read only up to FEATURES
 
     input:
-    - in_gb_file: text file with one accession ID per line
+    - in_gb_file: GenBank file, possibly gzip-compressed
 
     output:
     - dict(str,str): database -> accession
     """
-    dblink_dict = {}
-    with open(in_gb_file) as handle:
-        plasmid_record = GenBank.read(handle)
-        for dblink in plasmid_record.dblinks:
-            key = dblink.split(": ")[0]
-            val = dblink.split(": ")[1]
-            dblink_dict[key] = val
-    return dblink_dict
+    return read_genbank_dblinks(in_gb_file)
+
+def dblink_key(in_gb_file):
+    """
+    Cache key of the DBLINK entries of a GenBank file
+
+    input:
+    - in_gb_file: GenBank file
 
+    output:
+    - str: key depending on the path, size and modification time of the file
+    """
+    stat = os.stat(in_gb_file)
+    return make_key("dblink", os.path.abspath(in_gb_file), stat.st_size, stat.st_mtime_ns)
+
+def read_dblinks(in_gb_files, threads=1, cache_dir=None):
+    """
+    Read the DBLINK entries of many GenBank files in a process pool
+
+    input:
+    - in_gb_files: dict(str,str): plasmid ID -> GenBank file
+    - threads: number of processes
+    - cache_dir: directory of a cache of DBLINK entries, or None
+
+    output:
+    - dict(str->(dict(str,str)): plasmid ID -> (database -> accession)
+    """
+    cache = Cache(cache_dir) if cache_dir else None
+    plasmids_dblink_dict = {}
+    missing = []
+    for plasmid, gb_file in in_gb_files.items():
+        data = cache.get(dblink_key(gb_file)) if cache else None
+        if data is None:
+            missing.append(plasmid)
+        else:
+            plasmids_dblink_dict[plasmid] = json.loads(data)
+    if missing:
+        gb_files = [in_gb_files[plasmid] for plasmid in missing]
+        with Pool(threads) as pool:
+            for plasmid, gb_file, dblink_dict in zip(missing, gb_files, pool.imap(read_dblink_from_genbank_file, gb_files, chunksize=16)):
+                plasmids_dblink_dict[plasmid] = dblink_dict
+                if cache:
+                    cache.put(dblink_key(gb_file), json.dumps(dblink_dict).encode())
+    return {plasmid: plasmids_dblink_dict[plasmid] for plasmid in in_gb_files}
 
 def update_summary_file(in_summary_file, in_dblink_dict, out_summary_file):
     """
@@ -100,22 +144,27 @@ def update_summary_file(in_summary_file, in_dblink_dict, out_summary_file):
                     plasmid_row[key] = val
             writer.writerow(plasmid_row)
 
-def main(in_plasmids_accession_file, in_summary_file, in_data_dir, out_summary_file):
+def genbank_path(in_data_dir, plasmid):
+    # <plasmid>.gb, or its gzip/bgzip-compressed version
+    path = os.path.join(in_data_dir, f"{plasmid}.gb")
+    return path if os.path.exists(path) or not os.path.exists(f"{path}.gz") else f"{path}.gz"
+
+def main(in_plasmids_accession_file, in_summary_file, in_data_dir, out_summary_file, threads=1, cache_dir=None):
     plasmids_list = read_accession_file(in_plasmids_accession_file)
-    plasmids_dblink_dict = {}
-    for plasmid in plasmids_list:
-        gb_file = os.path.join(in_data_dir,f"{plasmid}.gb")
-        plasmids_dblink_dict[plasmid] = read_dblink_from_genbank_file(gb_file)
+    gb_files = {plasmid: genbank_path(in_data_dir, plasmid) for plasmid in plasmids_list}
+    plasmids_dblink_dict = read_dblinks(gb_files, threads, cache_dir)
     update_summary_file(in_summary_file, plasmids_dblink_dict, out_summary_file)
 
 
 
 if __name__ == '__main__':
-    in_plasmids_accession_file = sys.argv[1]
-    in_summary_file = sys.argv[2]
-    in_data_dir = sys.argv[3]
-    out_summary_file = sys.argv[4]
-
-    main(in_plasmids_accession_file, in_summary_file, in_data_dir, out_summary_file)
-    
-    
+    parser = argparse.ArgumentParser(description="Add BioSample, BioProject and Read accession IDs to a summary file.")
+    parser.add_argument("in_plasmids_accession_file", help="File containing the plasmids accession IDs")
+    parser.add_argument("in_summary_file", help="Initial TSV summary file")
+    parser.add_argument("in_data_dir", help="Directory with GenBank files, one per plasmid")
+    parser.add_argument("out_summary_file", help="Generated summary file")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of processes reading GenBank files")
+    parser.add_argument("-c", "--cache", help="Directory of a cache of DBLINK entries")
+    args = parser.parse_args()
+
+    main(args.in_plasmids_accession_file, args.in_summary_file, args.in_data_dir, args.out_summary_file, args.threads, args.cache)
@@ -0,0 +1,190 @@
+import logging
+import time
+from math import log
+from multiprocessing import Pool
+
+import networkx as nx
+
+from bidirected import FLIP, overlap
+
+
+def component_payload(G, nodes):
+    # Plain tuples that are cheap to send to a worker process
+    return ({node: (G.nodes[node].get('LEN', 0), G.nodes[node].get('DP', 0.0)) for node in nodes},
+            [(u, attr['From'], v, attr['To'], overlap(attr)) for u, v, attr in G.subgraph(nodes).edges(data=True)])
+
+
+def oriented_successors(edges):
+    succ = {}
+    for u, ori1, v, ori2, ov in edges:
+        succ.setdefault((u, ori1), []).append((v, ori2, ov))
+        if not (u == v and ori1 == FLIP[ori2]):
+            succ.setdefault((v, FLIP[ori2]), []).append((u, FLIP[ori1], ov))
+    return succ
+
+
+class Walker:
+    def __init__(self, nodes, succ, ratio, max_depth, max_expansions, deadline):
+        self.nodes = nodes; self.succ = succ
+        self.ratio = ratio; self.max_depth = max_depth
+        self.max_expansions = max_expansions; self.deadline = deadline
+
+    def consistent(self, node, coverage):
+        DP = self.nodes[node][1]
+        return coverage > 0 and DP > 0 and coverage / self.ratio <= DP <= coverage * self.ratio
+
+    def candidates(self, step, coverage, exclude=()):
+        # Coverage-consistent successors, closest coverage first
+        options = [(v, o, ov) for v, o, ov in self.succ.get(step, ())
+                   if v not in exclude and self.consistent(v, coverage)]
+        options.sort(key=lambda option: abs(log(self.nodes[option[0]][1] / coverage)))
+        return options
+
+    def cycle(self, seed):
+        # Bounded depth-first search for a walk that returns to seed[+]
+        LEN, DP = self.nodes[seed]
+        path = [(seed, '+')]; on_path = {seed}
+        weights = [(LEN * DP, LEN)]
+        stack = [iter(self.candidates((seed, '+'), DP))]
+        expansions = 0
+        while stack:
+            if expansions >= self.max_expansions or time.monotonic() > self.deadline:
+                return None
+            nxt = next(stack[-1], None)
+            if nxt is None:
+                stack.pop(); on_path.discard(path.pop()[0]); weights.pop()
+                continue
+            v, o, ov = nxt
+            if v == seed:
+                if o == '+':
+                    return path
+                continue
+            if v in on_path or len(path) >= self.max_depth:
+                continue
+            expansions += 1
+            LEN, DP = self.nodes[v]
+            XCov, L = weights[-1]
+            weights.append((XCov + LEN * DP, L + LEN))
+            path.append((v, o)); on_path.add(v)
+            coverage = weights[-1][0] / weights[-1][1] if weights[-1][1] else DP
+            stack.append(iter(self.candidates((v, o), coverage)))
+        return None
+
+    def extend(self, walk, on_walk):
+        # Greedy coverage-consistent extension of walk at its end
+        XCov = sum(self.nodes[v][0] * self.nodes[v][1] for v, _ in walk)
+        L = sum(self.nodes[v][0] for v, _ in walk)
+        while len(walk) < self.max_depth and time.monotonic() <= self.deadline:
+            coverage = XCov / L if L else self.nodes[walk[-1][0]][1]
+            options = self.candidates(walk[-1], coverage, on_walk)
+            if not options:
+                break
+            v, o, _ = options[0]
+            walk.append((v, o)); on_walk.add(v)
+            XCov += self.nodes[v][0] * self.nodes[v][1]; L += self.nodes[v][0]
+        return walk
+
+    def linear(self, seed):
+        on_walk = {seed}
+        forward = self.extend([(seed, '+')], on_walk)
+        backward = self.extend([(seed, '-')], on_walk)
+        return [(v, FLIP[o]) for v, o in backward[:0:-1]] + forward
+
+
+def walk_stats(nodes, succ, walk, circular):
+    overlaps = 0
+    steps = list(zip(walk, walk[1:] + walk[:1])) if circular else list(zip(walk, walk[1:]))
+    for (u, a), (v, b) in steps:
+        overlaps += next((ov for w, o, ov in succ.get((u, a), ()) if w == v and o == b), 0)
+    length = sum(nodes[v][0] for v, _ in walk) - overlaps
+    coverage = sum(nodes[v][0] * nodes[v][1] for v, _ in walk) / max(sum(nodes[v][0] for v, _ in walk), 1)
+    return length, coverage
+
+
+def search_component(task):
+    component, (nodes, edges), ratio, max_nodes, max_depth, max_expansions, time_budget = task
+    if len(nodes) > max_nodes:
+        return component, 'skipped', []
+
+    deadline = time.monotonic() + time_budget
+    succ = oriented_successors(edges)
+    walker = Walker(nodes, succ, ratio, max_depth, max_expansions, deadline)
+
+    walks = []; covered = set(); status = 'done'
+    for seed in sorted(nodes, key=lambda node: (-nodes[node][0], node)):
+        if seed in covered:
+            continue
+        if time.monotonic() > deadline:
+            status = 'timeout'; break
+        walk = walker.cycle(seed); circular = walk is not None
+        if not circular:
+            walk = walker.linear(seed)
+        covered.update(v for v, _ in walk)
+        walks.append(('circular' if circular else 'linear', walk, *walk_stats(nodes, succ, walk, circular)))
+    return component, status, walks
+
+
+def search_batch(tasks):
+    return [search_component(task) for task in tasks]
+
+
+def batch_tasks(G, components, options, batch_nodes=10000):
+    # Small components are sent to the workers together, in batches of at
+    # least batch_nodes nodes; components are largest first, so a large
+    # component is a batch of its own
+    batch = []; size = 0
+    for component, nodes in components:
+        batch.append((component, component_payload(G, nodes), *options))
+        size += len(nodes)
+        if size >= batch_nodes:
+            yield batch
+            batch = []; size = 0
+    if batch:
+        yield batch
+
+
+def find_walks(G, threads=1, ratio=2.0, max_nodes=100000, max_depth=1000, max_expansions=100000, time_budget=60.0):
+    # Candidate plasmid walks per weakly connected component. Components are
+    # searched in parallel, largest first, each with its own time budget.
+    components = sorted(nx.weakly_connected_components(G), key=lambda x: (-len(x), min(x)))
+    options = (ratio, max_nodes, max_depth, max_expansions, time_budget)
+
+    # Components over max_nodes are skipped and a single node without a
+    # self-loop is its own linear walk, both without sending a payload
+    results = {}; searched = []
+    for component, nodes in enumerate(components, 1):
+        node = next(iter(nodes))
+        if len(nodes) > max_nodes:
+            results[component] = ('skipped', [])
+        elif len(nodes) == 1 and not G.has_edge(node, node):
+            payload = {node: (G.nodes[node].get('LEN', 0), G.nodes[node].get('DP', 0.0))}
+            results[component] = ('done', [('linear', [(node, '+')], *walk_stats(payload, {}, [(node, '+')], False))])
+        else:
+            searched.append((component, nodes))
+
+    batches = batch_tasks(G, searched, options)
+    if threads > 1:
+        with Pool(threads) as pool:
+            for batch in pool.imap_unordered(search_batch, batches):
+                for component, status, walks in batch:
+                    results[component] = (status, walks)
+    else:
+        for batch in batches:
+            for component, status, walks in search_batch(batch):
+                results[component] = (status, walks)
+
+    for component in sorted(results):
+        status, _ = results[component]
+        if status != 'done':
+            logging.warning(f"Warning: walk search in component {component} {status} "
+                            f"({len(components[component-1])} nodes)")
+    return [(component, *results[component]) for component in sorted(results)]
+
+
+def write_walks(walks_file, results):
+    with open(walks_file, 'w') as fout:
+        fout.write("component\twalk\ttype\tlength_(bp)\tcoverage\t#nodes\tpath\n")
+        for component, status, walks in results:
+            for i, (kind, walk, length, coverage) in enumerate(walks, 1):
+                path = ','.join(f"{node}{ori}" for node, ori in walk)
+                fout.write(f"{component}\t{i}\t{kind}\t{length}\t{coverage}\t{len(walk)}\t{path}\n")
@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+
+from generate import generate, make_genomes, add_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def canonical(genes):
+    reverse = tuple(f"{'-' if gene[0] == '+' else '+'}{gene[1:]}" for gene in reversed(genes))
+    return min(tuple(genes), reverse)
+
+
+def true_kmers(args):
+    # Gene k-mers of the generated genomes; reads wrap around the gene order,
+    # so every replicon is treated as circular. make_genomes draws first from
+    # a fresh Random(seed), as in generate.
+    _, layouts = make_genomes(random.Random(args.seed), args)
+    kmers = set()
+    for _, _, order, strands, _, _ in layouts:
+        genes = [f"{strand}{name}" for name, strand in zip(order, strands)]
+        if len(genes) < args.k:
+            continue
+        for i in range(len(genes)):
+            kmers.add(canonical([genes[(i + j) % len(genes)] for j in range(args.k)]))
+    return kmers
+
+
+def gfa_kmers(gfa_file):
+    kmers = []
+    with open(gfa_file) as file:
+        for line in file:
+            if line.startswith('S\t'):
+                label = next(tag[5:] for tag in line.rstrip('\n').split('\t')[3:] if tag.startswith('GN:Z:'))
+                kmers.append(canonical(label[1:-1].split(',')))
+    return kmers
+
+
+def extract(data_dir, k, options):
+    gfa_file = os.path.join(data_dir, 'graph.gfa')
+    command = [sys.executable, os.path.join(ROOT, 'extract_kmers.py'), '-f', os.path.join(data_dir, 'genes.fq'),
+               '-g', os.path.join(data_dir, 'calls.json'), '-o', gfa_file, '-k', str(k)] + options
+    log = subprocess.run(command, check=True, capture_output=True, text=True).stderr
+    return gfa_kmers(gfa_file), [line.split('] ', 1)[-1] for line in log.splitlines() if 'Error correction' in line]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the graph correction of extract_kmers.py (-e) against the k-mers of the generated genomes.")
+    parser.add_argument("-n", "--reads", type=int, default=10000, help="Number of reads")
+    parser.add_argument("-d", "--work_dir", help="Directory for the generated input and the GFA (default: a temporary directory)")
+    parser.add_argument("--extract_args", default="", help="Extra arguments for extract_kmers.py, e.g. --extract_args='--min_reads 1'")
+    parser.add_argument("--max_true_loss", type=float, default=0.01, help="Largest fraction of true k-mers correction may remove")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.work_dir or tmp
+        generate(argparse.Namespace(**{**vars(args), 'output_dir': data_dir, 'kmers': 0}))
+        truth = true_kmers(args)
+        options = shlex.split(args.extract_args)
+        raw, _ = extract(data_dir, args.k, options)
+        corrected, log = extract(data_dir, args.k, options + ['-e'])
+
+    raw_true = sum(kmer in truth for kmer in raw); raw_false = len(raw) - raw_true
+    true = sum(kmer in truth for kmer in corrected); false = len(corrected) - true
+    for line in log:
+        print(line, file=sys.stderr)
+    print(f"k={args.k}\t{args.reads} reads\t{len(truth)} true k-mers", file=sys.stderr)
+    print(f"uncorrected\t{len(raw)} nodes\t{raw_true} true\t{raw_false} spurious", file=sys.stderr)
+    print(f"corrected\t{len(corrected)} nodes\t{true} true\t{false} spurious", file=sys.stderr)
+    print(f"removed {raw_false - false} of {raw_false} spurious and {raw_true - true} of {raw_true} true nodes", file=sys.stderr)
+
+    if raw_true - true > args.max_true_loss * raw_true:
+        print(f"Error: correction removed more than {args.max_true_loss:.1%} of the true k-mers", file=sys.stderr)
+        exit(1)
+    if raw_false and false >= raw_false:
+        print("Error: correction removed no spurious k-mers", file=sys.stderr)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import random
+import sys
+from math import log
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bidirected import reverse_complement
+
+
+def random_sequence(r, length):
+    return ''.join(r.choices('ACGT', k=length))
+
+
+def gene_length(r, median, sigma=0.4):
+    return min(max(int(r.lognormvariate(log(median), sigma)), 150), 5000)
+
+
+def make_genomes(r, args):
+    # One chromosome and a set of plasmids as gene orders; a few genes (mobile
+    # elements) are shared between plasmids and with the chromosome
+    genes = {}
+    def new_gene(prefix):
+        name = f"{prefix}_{len(genes)}"
+        genes[name] = random_sequence(r, gene_length(r, args.gene_length))
+        return name
+
+    shared = [new_gene('mobile') for _ in range(args.shared_genes)]
+    genomes = [('chromosome', 'CHR', [new_gene('chr') for _ in range(args.chromosome_genes)])]
+    for i in range(args.plasmids):
+        order = [new_gene(f'p{i}') for _ in range(r.randint(args.plasmid_genes // 2, args.plasmid_genes * 3 // 2))]
+        for name in r.sample(shared, min(len(shared), r.randint(0, 3))):
+            order.insert(r.randrange(len(order) + 1), name)
+        genomes.append(('plasmid', f'PLS{i}', order))
+    if shared:
+        order = genomes[0][2]
+        for name in r.sample(shared, min(len(shared), 2)):
+            order.insert(r.randrange(len(order) + 1), name)
+
+    # Genome sequences with intergenic gaps, for the k-mer Fasta
+    layouts = []
+    for cläss, accession, order in genomes:
+        strands = [r.choice('+-') for _ in order]
+        parts = []; coordinates = []; pos = 0
+        for name, strand in zip(order, strands):
+            gap = random_sequence(r, r.randint(0, args.max_gap))
+            parts.append(gap); pos += len(gap)
+            sequence = genes[name] if strand == '+' else reverse_complement(genes[name])
+            coordinates.append((pos + 1, pos + len(sequence)))
+            parts.append(sequence); pos += len(sequence)
+        layouts.append((cläss, accession, order, strands, coordinates, ''.join(parts)))
+    return genes, layouts
+
+
+def sample_read(r, args, layouts):
+    if r.random() < args.plasmid_fraction and len(layouts) > 1:
+        layout = r.choice(layouts[1:])
+    else:
+        layout = layouts[0]
+    cläss, accession, order, strands, coordinates, sequence = layout
+    length = min(max(1, round(r.gauss(args.genes_per_read, args.genes_per_read / 3))), len(order))
+    start = r.randrange(len(order))
+    positions = [(start + i) % len(order) for i in range(length)]
+    return layout, positions, r.random() < 0.5
+
+
+def gene_calls(r, args, names, layout, positions, reverse):
+    _, _, order, strands, _, _ = layout
+    calls = [f"{strands[i]}{order[i]}" for i in positions]
+    if reverse:
+        calls = [f"{'-' if call[0] == '+' else '+'}{call[1:]}" for call in reversed(calls)]
+
+    # Gene-calling errors: substitutions, deletions, insertions and strand flips
+    noisy = []
+    for call in calls:
+        if r.random() < args.error_rate:
+            error = r.randrange(4)
+            if error == 0:
+                noisy.append(f"{call[0]}{r.choice(names)}")
+            elif error == 1:
+                pass
+            elif error == 2:
+                noisy.append(call); noisy.append(f"{r.choice('+-')}{r.choice(names)}")
+            else:
+                noisy.append(f"{'-' if call[0] == '+' else '+'}{call[1:]}")
+        else:
+            noisy.append(call)
+        if r.random() < args.missing_rate:
+            noisy.append(f"{r.choice('+-')}missing_{r.randrange(100)}")
+    return noisy
+
+
+def kmer_records(args, layout, positions, read):
+    # Gene k-mers of a read at their true genome coordinates (build_graph.py input)
+    cläss, accession, order, strands, coordinates, sequence = layout
+    for i in range(len(positions) - args.k + 1):
+        window = positions[i:i + args.k]
+        if window[-1] < window[0]:
+            continue
+        start = coordinates[window[0]][0]; end = coordinates[window[-1]][1]
+        kmer = ','.join(order[j] for j in window)
+        yield f">{kmer}|{accession}@{start}-{end}|{end - start + 1}|{cläss}|{read}\n{sequence[start - 1:end]}\n"
+
+
+def generate(args):
+    r = random.Random(args.seed)
+    genes, layouts = make_genomes(r, args)
+    names = list(genes)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    with open(os.path.join(args.output_dir, 'genes.fq'), 'w') as fout:
+        for name, sequence in genes.items():
+            fout.write(f"@{name}\n{sequence}\n+\n{'I' * len(sequence)}\n")
+
+    kmer_file = open(os.path.join(args.output_dir, 'kmers.fasta'), 'w') if args.kmers else None
+    with open(os.path.join(args.output_dir, 'calls.json'), 'w') as fout:
+        fout.write('{')
+        for i in range(args.reads):
+            read = f"read_{i:07d}"
+            layout, positions, reverse = sample_read(r, args, layouts)
+            calls = gene_calls(r, args, names, layout, positions, reverse)
+            fout.write(f"{',' if i else ''}\n  {json.dumps(read)}: {json.dumps(calls)}")
+            if kmer_file and i < args.kmers:
+                kmer_file.writelines(kmer_records(args, layout, positions, read))
+        fout.write('\n}\n')
+    if kmer_file:
+        kmer_file.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--genes_per_read", type=float, default=12, help="Mean number of genes per read")
+    parser.add_argument("--gene_length", type=int, default=900, help="Median gene length (log-normal, 150-5000 bp)")
+    parser.add_argument("--max_gap", type=int, default=200, help="Maximum intergenic gap length")
+    parser.add_argument("--chromosome_genes", type=int, default=2000, help="Number of chromosome genes")
+    parser.add_argument("--plasmids", type=int, default=5, help="Number of plasmids")
+    parser.add_argument("--plasmid_genes", type=int, default=60, help="Mean number of genes per plasmid")
+    parser.add_argument("--shared_genes", type=int, default=10, help="Number of mobile genes shared between replicons")
+    parser.add_argument("--plasmid_fraction", type=float, default=0.3, help="Fraction of reads sampled from plasmids")
+    parser.add_argument("--error_rate", type=float, default=0.02, help="Gene-call error rate (substitution, deletion, insertion, strand flip)")
+    parser.add_argument("--missing_rate", type=float, default=0.001, help="Rate of calls to genes without a consensus sequence")
+    parser.add_argument("-k", type=int, default=5, help="Number of genes per k-mer in the k-mer Fasta")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Amira-style input (gene FASTQ, gene-call JSON, k-mer Fasta).")
+    parser.add_argument("-o", "--output_dir", required=True, help="Directory to write genes.fq, calls.json and kmers.fasta to")
+    parser.add_argument("-n", "--reads", type=int, default=1000, help="Number of reads")
+    parser.add_argument("--kmers", type=int, default=0, help="Write the k-mers of the first KMERS reads to kmers.fasta")
+    add_arguments(parser)
+    generate(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
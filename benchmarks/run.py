@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import generate, add_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_ARGS = ('seed', 'genes_per_read', 'gene_length', 'max_gap', 'chromosome_genes', 'plasmids',
+                  'plasmid_genes', 'shared_genes', 'plasmid_fraction', 'error_rate', 'missing_rate', 'k')
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def prepare(args, reads, kmers):
+    # Inputs are generated once per parameter set and reused across runs
+    params = {name: value for name, value in vars(args).items() if name in GENERATOR_ARGS}
+    params.update(reads=reads, kmers=kmers)
+    data_dir = os.path.join(args.work_dir, f"n{reads}_s{args.seed}")
+    params_file = os.path.join(data_dir, 'params.json')
+    if os.path.exists(params_file):
+        with open(params_file) as file:
+            existing = json.load(file)
+        if {**existing, 'kmers': kmers} == params and existing['kmers'] >= kmers:
+            return data_dir, existing
+
+    print(f"Generating {reads} reads in {data_dir}", file=sys.stderr)
+    generate(argparse.Namespace(output_dir=data_dir, **params))
+    with open(params_file, 'w') as fout:
+        json.dump(params, fout)
+    return data_dir, params
+
+
+def run(command, reads):
+    with tempfile.TemporaryDirectory() as tmp:
+        report_file = os.path.join(tmp, 'report.json')
+        start = time.perf_counter()
+        subprocess.run(command + ['--report', report_file], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        with open(report_file) as file:
+            report = json.load(file)
+    return {'seconds': seconds, 'reads_per_sec': reads / seconds, 'peak_rss': report['peak_rss'],
+            'stages': report['stages'], 'counters': report['counters']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extract_kmers.py and build_graph.py on synthetic data.")
+    parser.add_argument("-s", "--sizes", type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help="Numbers of reads for extract_kmers.py")
+    parser.add_argument("-g", "--graph_sizes", type=int, nargs='*', default=[1000, 10000], help="Numbers of reads for build_graph.py (the k-mer Fasta grows by ~40 kB per read)")
+    parser.add_argument("-d", "--work_dir", default=os.path.join(ROOT, 'benchmarks', 'data'), help="Directory for generated inputs and outputs")
+    parser.add_argument("-o", "--output_file", default=os.path.join(ROOT, 'benchmarks', 'results.jsonl'), help="JSONL file to append results to")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Runs per size; the fastest is recorded")
+    parser.add_argument("--extract_args", default="", help="Extra arguments for extract_kmers.py, e.g. --extract_args='-t 4 -k 3 5 7'")
+    parser.add_argument("--graph_args", default="", help="Extra arguments for build_graph.py")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    tools = [('extract_kmers.py', size) for size in args.sizes] + [('build_graph.py', size) for size in args.graph_sizes]
+    for tool, size in tools:
+        data_dir, params = prepare(args, size, size if size in args.graph_sizes else 0)
+        if tool == 'extract_kmers.py':
+            command = [sys.executable, os.path.join(ROOT, tool), '-f', os.path.join(data_dir, 'genes.fq'),
+                       '-g', os.path.join(data_dir, 'calls.json'), '-o', os.path.join(data_dir, 'graph.gfa')]
+            command += shlex.split(args.extract_args)
+        else:
+            command = [sys.executable, os.path.join(ROOT, tool), os.path.join(data_dir, 'kmers.fasta'),
+                       os.path.join(data_dir, 'kmers.gfa')]
+            command += shlex.split(args.graph_args)
+
+        result = min((run(command, size) for _ in range(args.repeat)), key=lambda result: result['seconds'])
+        record = {'tool': tool, 'reads': size, **result, 'commit': commit, 'dirty': dirty,
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                  'args': args.extract_args if tool == 'extract_kmers.py' else args.graph_args, 'generator': params}
+        with open(args.output_file, 'a') as fout:
+            fout.write(json.dumps(record) + '\n')
+        print(f"{tool}\t{size}\t{result['seconds']:.2f} s\t{result['reads_per_sec']:.0f} reads/s\t"
+              f"{(result['peak_rss'] or 0) / 2**20:.0f} MiB", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
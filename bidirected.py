@@ -0,0 +1,73 @@
+# Helpers for walking the bidirected graphs written by extract_kmers.py and
+# build_graph.py: a link u -> v with orientations From/To reads u[From] v[To]
+# and, on the other strand, v[-To] u[-From].
+
+FLIP = {'+': '-', '-': '+'}
+
+
+def reverse_complement(seq):
+    translation_table = str.maketrans('ATCG', 'TAGC')
+    return seq.translate(translation_table)[::-1]
+
+
+def adjacent(G, adjacency):
+    # (neighbor, link attributes) pairs; a MultiDiGraph may keep several
+    # links with different orientations between the same two nodes
+    if G.is_multigraph():
+        return ((v, attr) for v, links in adjacency.items() for attr in links.values())
+    return adjacency.items()
+
+
+def links(G, node1, node2):
+    # attributes of all links stored as node1 -> node2
+    data = G.succ[node1].get(node2)
+    if data is None:
+        return ()
+    return data.values() if G.is_multigraph() else (data,)
+
+
+def successors(G, node, ori):
+    for v, attr in adjacent(G, G.succ[node]):
+        if attr['From'] == ori:
+            yield v, attr['To']
+    for u, attr in adjacent(G, G.pred[node]):
+        if attr['To'] == FLIP[ori]:
+            # a link u[+] -> u[-] is its own reverse complement
+            if u == node and attr['From'] == ori:
+                continue
+            yield u, FLIP[attr['From']]
+
+
+def predecessors(G, node, ori):
+    for v, o in successors(G, node, FLIP[ori]):
+        yield v, FLIP[o]
+
+
+def link(G, node1, ori1, node2, ori2):
+    # attributes of the link node1[ori1] -> node2[ori2], in either stored direction
+    for attr in links(G, node1, node2):
+        if attr['From'] == ori1 and attr['To'] == ori2:
+            return attr
+    for attr in links(G, node2, node1):
+        if attr['From'] == FLIP[ori2] and attr['To'] == FLIP[ori1]:
+            return attr
+    return None
+
+
+def add_link(G, node1, ori1, node2, ori2, **attr):
+    # False if the link is already there, or if a DiGraph has no room for it
+    # (both directions between the two nodes hold other links)
+    if link(G, node1, ori1, node2, ori2) is not None:
+        return False
+    if G.is_multigraph() or not G.has_edge(node1, node2):
+        G.add_edge(node1, node2, From=ori1, To=ori2, **attr)
+    elif not G.has_edge(node2, node1):
+        G.add_edge(node2, node1, From=FLIP[ori2], To=FLIP[ori1], **attr)
+    else:
+        return False
+    return True
+
+
+def overlap(attr):
+    CIGAR = attr.get('CIGAR', '')
+    return int(CIGAR[:-1]) if CIGAR else 0
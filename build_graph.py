@@ -2,149 +2,247 @@ import networkx as nx
 #import layout as nx2
 from matplotlib import pyplot as plt
 
-from sys import argv, stderr
+from sys import stderr
 from time import time
 from math import sqrt, floor, ceil
 from threading import Thread as thread
+import argparse
+import numpy as np
+
+from graph_io import open_output, save_graph_npz
+from unitigs import compact_unitigs
+from correction import correct_graph
+from assembly import find_walks, write_walks
+from instrumentation import Report
+from parsers import read_fasta
+
+parser = argparse.ArgumentParser(description="Build a de Bruijn graph from a gene k-mer Fasta file.")
+parser.add_argument("kmer_file", help="Path to the k-mer Fasta file (may be gzip/bgzip-compressed)")
+parser.add_argument("output_file", help="Path to the Output file")
+parser.add_argument("-z", "--compression", choices=["gzip", "bgzip"], help="Compress the GFA output")
+parser.add_argument("-b", "--binary", help="Path to a binary graph (.npz) to write")
+parser.add_argument("--bulk", action='store_true', default=False, help="Build the (k-1)-mer index after all k-mers are loaded")
+parser.add_argument("-u", "--unitigs", action='store_true', default=False, help="Merge non-branching paths into unitigs before writing")
+parser.add_argument("-e", "--correct", action='store_true', default=False, help="Clip tips, pop bubbles and prune low-coverage nodes")
+parser.add_argument("--min_reads", type=int, default=2, help="Minimum number of supporting reads per node (with -e)")
+parser.add_argument("--max_tip", type=int, help="Maximum tip length in nodes (with -e, default: k)")
+parser.add_argument("--max_bubble", type=int, help="Maximum bubble branch length in nodes (with -e, default: k)")
+parser.add_argument("-w", "--walks", help="Path to a TSV file of candidate plasmid walks to write")
+parser.add_argument("--walk_time", type=float, default=60, help="Walk search time budget per component in seconds")
+parser.add_argument("--walk_nodes", type=int, default=100000, help="Skip the walk search in components with more nodes")
+parser.add_argument("-t", "--threads", type=int, default=1, help="Number of worker processes for the walk search")
+parser.add_argument("--report", help="Path to a JSON report of stage times, peak memory and counters to write")
+parser.add_argument("--profile", help="Path to a cProfile dump of the run to write")
+args = parser.parse_args()
+report = Report("build_graph.py", args, profile=bool(args.profile))
 
 # Create a directed graph
 G = nx.DiGraph(); index = {}
 node_IDs = {}; NODE_ID = 1
-L = 0; R = 1; ___ = ','
+gene_IDs = {}; L = 0; R = 1
+LANE = 32
+
+# Node coordinates by node ID, sequences as offsets into one buffer
+starts = [0]; ends = [0]; lengths = [0]
+seq_offsets = [0]; seq_sizes = [0]; buffer = bytearray()
+links = []
+
+
+def encode_kmer(kmer):
+    code = 0
+    for gene in kmer.split(','):
+        if gene not in gene_IDs:
+            gene_IDs[gene] = len(gene_IDs) + 1
+        code = code << LANE | gene_IDs[gene]
+    return code, kmer.count(',') + 1
+
+
+def split_kmer(code, k):
+    # (k-1)-mer codes of the prefix and the suffix
+    return code >> LANE, code & ((1 << LANE * (k - 1)) - 1)
+
+
+def add_link(LEFT_ID, RIGHT_ID):
+    G.add_edge(LEFT_ID, RIGHT_ID)
+    G.edges[LEFT_ID, RIGHT_ID]["From"] = '+'
+    G.edges[LEFT_ID, RIGHT_ID]["To"] = '+'
+    links.append((LEFT_ID, RIGHT_ID))
+
+
+def slice_bounds(index, size):
+    # Python slice semantics for arrays of indices
+    return np.clip(np.where(index < 0, index + size, index), 0, size)
+
+
+def node_sequence(node_id):
+    return buffer[SEQ_START[node_id]:SEQ_END[node_id]].decode()
+
 
 # Add nodes and edges
-with open(argv[1], 'r') as file:
-    while line := file.readline():
-        if line.startswith('>'):
-            kmer, pos, length, cläss, read = line[1:-1].split('|')
-            accession, coordinates = pos.split('@')
-            start, end = coordinates.split('-')
-            sequence = file.readline()[:-1]
+with report.stage('parse'):
+    for header, sequence in read_fasta(args.kmer_file):
+        report.count('kmers')
+        kmer, pos, length, cläss, read = header.split('|')
+        accession, coordinates = pos.split('@')
+        start, end = coordinates.split('-')
+        code, k = encode_kmer(kmer)
+        
+        if code not in node_IDs:
+            G.add_node(NODE_ID)
+            G.nodes[NODE_ID]['KMER'] = kmer
+            G.nodes[NODE_ID]['ACC'] = accession
+            G.nodes[NODE_ID]['START'] = int(start)
+            G.nodes[NODE_ID]['END'] = int(end)
+            G.nodes[NODE_ID]['LEN'] = int(length)
+            G.nodes[NODE_ID]['CLASS'] = cläss
+            G.nodes[NODE_ID]['LR'] = set()
+            G.nodes[NODE_ID]['CODE'] = code
+            G.nodes[NODE_ID]['K'] = k
+            node_IDs[code] = NODE_ID
             
-            if kmer not in node_IDs:
-                G.add_node(NODE_ID)
-                G.nodes[NODE_ID]['SEQ'] = sequence
-                G.nodes[NODE_ID]['KMER'] = kmer
-                G.nodes[NODE_ID]['ACC'] = accession
-                G.nodes[NODE_ID]['START'] = int(start)
-                G.nodes[NODE_ID]['END'] = int(end)
-                G.nodes[NODE_ID]['LEN'] = int(length)
-                G.nodes[NODE_ID]['CLASS'] = cläss
-                G.nodes[NODE_ID]['LR'] = set()
-                
-                L_link, ___, R_core = kmer.partition(___)
-                L_core, ___, R_link = kmer.rpartition(___)
-                
-                if R_core not in index:
-                    index[R_core] = (set(), set())
-                if L_link not in index[R_core][L]:
-                    index[R_core][L].add(L_link)
-                
-                if L_core not in index:
-                    index[L_core] = (set(), set())
-                if R_link not in index[L_core][R]:
-                    index[L_core][R].add(R_link)
+            starts.append(int(start)); ends.append(int(end)); lengths.append(int(length))
+            seq_offsets.append(len(buffer)); seq_sizes.append(len(sequence))
+            buffer += sequence
+            
+            if not args.bulk:
+                L_core, R_core = split_kmer(code, k)
+                index.setdefault(R_core, ([], []))[L].append(NODE_ID)
+                index.setdefault(L_core, ([], []))[R].append(NODE_ID)
                 
-                for L_link in index[L_core][L]:
-                    Lmer = f"{L_link}{___}{L_core}"
-                    LEFT_ID = node_IDs[Lmer]
+                for LEFT_ID in index[L_core][L]:
                     if not G.has_edge(LEFT_ID, NODE_ID):
-                        
-                        BSTART = G.nodes[NODE_ID]['START']
-                        AEND = G.nodes[LEFT_ID]['END']
-                        if BSTART <= AEND:
-                            LENGTH = AEND - BSTART + 1
-                        else:
-                            ASTART = G.nodes[LEFT_ID]['START']
-                            ALENGTH = G.nodes[LEFT_ID]['LEN']
-                            LENGTH = ALENGTH - (BSTART-ASTART)
-                        
-                        G.add_edge(LEFT_ID, NODE_ID)
-                        G.edges[LEFT_ID, NODE_ID]["From"] = '+'
-                        G.edges[LEFT_ID, NODE_ID]["To"] = '+'
-                        G.edges[LEFT_ID, NODE_ID]["CIGAR"] = f"{LENGTH}M"
+                        add_link(LEFT_ID, NODE_ID)
                 
-                for R_link in index[R_core][R]:
-                    Rmer = f"{R_core}{___}{R_link}"
-                    RIGHT_ID = node_IDs[Rmer]
+                for RIGHT_ID in index[R_core][R]:
                     if not G.has_edge(NODE_ID, RIGHT_ID):
-                        
-                        BSTART = G.nodes[RIGHT_ID]['START']
-                        AEND = G.nodes[NODE_ID]['END']
-                        if BSTART <= AEND:
-                            LENGTH = AEND - BSTART + 1
-                        else:
-                            ASTART = G.nodes[NODE_ID]['START']
-                            ALENGTH = G.nodes[NODE_ID]['LEN']
-                            LENGTH = ALENGTH - (BSTART-ASTART)
-                        
-                        G.add_edge(NODE_ID, RIGHT_ID)
-                        G.edges[NODE_ID, RIGHT_ID]["From"] = '+'
-                        G.edges[NODE_ID, RIGHT_ID]["To"] = '+'
-                        G.edges[NODE_ID, RIGHT_ID]["CIGAR"] = f"{LENGTH}M"
-                
-                node_IDs[kmer] = NODE_ID; NODE_ID += 1
-            G.nodes[node_IDs[kmer]]['LR'].add(read)
+                        add_link(NODE_ID, RIGHT_ID)
+            
+            NODE_ID += 1
+        G.nodes[node_IDs[code]]['LR'].add(read)
 
+if args.bulk:
+    with report.stage('index'):
+        for node_id, attr in G.nodes(data=True):
+            L_core, _ = split_kmer(attr['CODE'], attr['K'])
+            index.setdefault(L_core, []).append(node_id)
+        
+        for node_id, attr in G.nodes(data=True):
+            _, R_core = split_kmer(attr['CODE'], attr['K'])
+            for RIGHT_ID in index.get(R_core, ()):
+                add_link(node_id, RIGHT_ID)
+report.count('nodes', G.number_of_nodes())
+report.count('edges', len(links))
 
-for node_id in G.nodes:
-    LCUT = 0; RCUT = 0
-    in_edges = [attr for _, _, attr in G.in_edges(node_id, data=True)]
-    out_edges = [attr for _, _, attr in G.out_edges(node_id, data=True)]
-    
-    if len(in_edges) > 0:
-        LCUT = floor(int(in_edges[0]["CIGAR"][:-1]) / 2)
-    if len(out_edges) > 0:
-        RCUT = ceil(int(out_edges[0]["CIGAR"][:-1]) / 2)
-    
-    RCUT = len(G.nodes[node_id]['SEQ']) - RCUT
-    G.nodes[node_id]['SEQ'] = G.nodes[node_id]['SEQ'][LCUT:RCUT]
-    G.nodes[node_id]['LEN'] = len(G.nodes[node_id]['SEQ'])
 
-for edge_u, edge_v in G.edges():
-    G.edges[edge_u, edge_v]["CIGAR"] = '0M'
+with report.stage('overlaps'):
+    # Overlaps of all links, in the order they were added
+    START = np.array(starts, dtype=np.int64); END = np.array(ends, dtype=np.int64)
+    LENGTH = np.array(lengths, dtype=np.int64)
+    U = np.array([u for u, _ in links], dtype=np.int64)
+    V = np.array([v for _, v in links], dtype=np.int64)
+    OVERLAP = np.where(START[V] <= END[U], END[U] - START[V] + 1, LENGTH[U] - (START[V] - START[U]))
+
+    # Trim half of the overlap of the first in- and out-link from each node
+    LCUT = np.zeros(NODE_ID, dtype=np.int64); RCUT = np.zeros(NODE_ID, dtype=np.int64)
+    nodes, first = np.unique(V, return_index=True)
+    LCUT[nodes] = OVERLAP[first] // 2
+    nodes, first = np.unique(U, return_index=True)
+    RCUT[nodes] = -(-OVERLAP[first] // 2)
+
+    OFFSET = np.array(seq_offsets, dtype=np.int64); SIZE = np.array(seq_sizes, dtype=np.int64)
+    SEQ_START = OFFSET + slice_bounds(LCUT, SIZE)
+    SEQ_END = np.maximum(OFFSET + slice_bounds(SIZE - RCUT, SIZE), SEQ_START)
 
+    LENS = (SEQ_END - SEQ_START).tolist()
+    for node_id in G.nodes:
+        G.nodes[node_id]['LEN'] = LENS[node_id]
 
-L = 0; Cov = 0
-for node_id, attr in G.nodes(data=True):
-    LEN = attr.get('LEN', 0)
-    LR = attr.get('LR', set())
-    XCov = len(LR) * LEN
-    L += LEN; Cov += XCov
-AvgCov = Cov / L
+    nx.set_edge_attributes(G, '0M', "CIGAR")
 
-for node_id, attr in G.nodes(data=True):
-    LEN = attr.get('LEN', 0)
-    LR = attr.get('LR', set())
-    XCov = len(LR) * LEN
-    XAvgCov = XCov / LEN
-    XNormCov = XAvgCov / AvgCov
-    G.nodes[node_id]['DP'] = XNormCov
+if args.correct:
+    k = max((attr['K'] for _, attr in G.nodes(data=True)), default=0)
+    with report.stage('correct'):
+        correct_graph(G, args.min_reads, args.max_tip or k, args.max_bubble or k)
 
 
-with open(argv[2], 'w') as fout:
-    fout.write("H\n")
+with report.stage('coverage'):
+    L = 0; Cov = 0
+    for node_id, attr in G.nodes(data=True):
+        LEN = attr.get('LEN', 0)
+        LR = attr.get('LR', set())
+        XCov = len(LR) * LEN
+        L += LEN; Cov += XCov
+    # Correction may remove every node; the empty graph is still written
+    if not L:
+        stderr.write(f"Warning: the graph is empty{' after correction' if args.correct else ''}\n")
+    AvgCov = Cov / L if L else 0
 
-    # Write sequences
     for node_id, attr in G.nodes(data=True):
-        SEQ = attr.get('SEQ', '')
-        KMER = attr.get('KMER', '')
-        ACC = attr.get('ACC', '')
-        START = attr.get('START', '')
-        END = attr.get('END', '')
-        LEN = attr.get('LEN', '')
-        DP = attr.get('DP', '')
-        CLASS = attr.get('CLASS', '')
+        LEN = attr.get('LEN', 0)
         LR = attr.get('LR', set())
-        LR = str(list(LR)).replace("'", "").replace(' ', '')
-        fout.write(f"S\t{node_id}\t{SEQ}\tGN:Z:{KMER}\tSEG:Z:{ACC}@{START}-{END}\tLN:i:{LEN}\tdp:f:{DP}\tclass:Z:{CLASS}\tLR:Z:{LR}\n")
-
-    # Write links
-    for u, v, attr in G.edges(data=True):
-        FROM = attr.get('From', '')
-        TO = attr.get('To', '')
-        CIGAR = attr.get('CIGAR', '')
-        fout.write(f"L\t{u}\t{FROM}\t{v}\t{TO}\t{CIGAR}\n")
+        XCov = len(LR) * LEN
+        XAvgCov = XCov / LEN if LEN > 0 else 0
+        XNormCov = XAvgCov / AvgCov if AvgCov else 0
+        G.nodes[node_id]['DP'] = XNormCov
+
+sequence = lambda node_id, attr: node_sequence(node_id)
+
+if args.unitigs:
+    with report.stage('unitigs'):
+        K = G; G = compact_unitigs(K, sequence)
+    stderr.write(f"Compacted {K.number_of_nodes()} nodes into {G.number_of_nodes()} unitigs\n")
+    report.count('unitigs', G.number_of_nodes())
+    
+    for node_id, attr in G.nodes(data=True):
+        first = K.nodes[attr['PATH'][0][0]]; last = K.nodes[attr['PATH'][-1][0]]
+        genes = []
+        for node, ori in attr['PATH']:
+            kmer = K.nodes[node]['KMER'].split(',')
+            if ori == '-': kmer.reverse()
+            genes.extend(kmer[-1:] if genes else kmer)
+        classes = {K.nodes[node]['CLASS'] for node, _ in attr['PATH']}
+        
+        attr['KMER'] = ','.join(genes)
+        attr['ACC'] = first['ACC']; attr['START'] = first['START']; attr['END'] = last['END']
+        attr['CLASS'] = classes.pop() if len(classes) == 1 else 'mixed'
+    
+    sequence = lambda node_id, attr: attr['SEQ']
+
+
+with report.stage('write'):
+    with open_output(args.output_file, args.compression) as fout:
+        fout.write("H\n")
+
+        # Write sequences
+        for node_id, attr in G.nodes(data=True):
+            SEQ = sequence(node_id, attr)
+            KMER = attr.get('KMER', '')
+            ACC = attr.get('ACC', '')
+            START = attr.get('START', '')
+            END = attr.get('END', '')
+            LEN = attr.get('LEN', '')
+            DP = attr.get('DP', '')
+            CLASS = attr.get('CLASS', '')
+            LR = attr.get('LR', set())
+            LR = str(list(LR)).replace("'", "").replace(' ', '')
+            fout.write(f"S\t{node_id}\t{SEQ}\tGN:Z:{KMER}\tSEG:Z:{ACC}@{START}-{END}\tLN:i:{LEN}\tdp:f:{DP}\tclass:Z:{CLASS}\tLR:Z:{LR}\n")
+
+        # Write links
+        for u, v, attr in G.edges(data=True):
+            FROM = attr.get('From', '')
+            TO = attr.get('To', '')
+            CIGAR = attr.get('CIGAR', '')
+            fout.write(f"L\t{u}\t{FROM}\t{v}\t{TO}\t{CIGAR}\n")
+
+    if args.binary:
+        save_graph_npz(args.binary, G, sequence, lambda node_id, attr: attr['KMER'],
+                       columns=('ACC', 'START', 'END', 'CLASS'))
+
+if args.walks:
+    with report.stage('walks'):
+        write_walks(args.walks, find_walks(G, args.threads, max_nodes=args.walk_nodes, time_budget=args.walk_time))
+
+report.finish(args.report, args.profile)
 exit()
 
 DIST = None
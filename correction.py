@@ -0,0 +1,133 @@
+import logging
+
+from bidirected import successors, predecessors
+
+
+def read_coverage(attr):
+    return len(attr.get('LR', ()))
+
+
+def degree(neighbours, limit=2):
+    count = 0
+    for _ in neighbours:
+        count += 1
+        if count >= limit:
+            break
+    return count
+
+
+def follow_chain(G, node, ori, max_nodes, removed):
+    # Walk from node[ori] while every node has a single successor whose only
+    # predecessor is the current node; stop at the first junction.
+    chain = [(node, ori)]
+    while len(chain) <= max_nodes:
+        succ = [nxt for nxt in successors(G, *chain[-1]) if nxt[0] not in removed]
+        if len(succ) != 1:
+            return chain, None
+        nxt = succ[0]
+        if degree(n for n, _ in predecessors(G, *nxt) if n not in removed) > 1:
+            return chain, nxt
+        if any(n == nxt[0] for n, _ in chain):
+            return chain, None
+        chain.append(nxt)
+    return chain, None
+
+
+def prune_low_coverage(G, min_coverage, coverage=read_coverage):
+    removed = [node for node, attr in G.nodes(data=True) if coverage(attr) < min_coverage]
+    G.remove_nodes_from(removed)
+    return len(removed)
+
+
+def clip_tips(G, max_tip, coverage=read_coverage):
+    # A tip is a dead-end chain of at most max_tip nodes that runs into a
+    # junction and is not better covered than the junction itself.
+    removed = set()
+    for node in list(G.nodes):
+        for ori in '+-':
+            if node in removed:
+                break
+            if degree(n for n, _ in predecessors(G, node, ori) if n not in removed) > 0:
+                continue
+            chain, junction = follow_chain(G, node, ori, max_tip, removed)
+            if junction is None or len(chain) > max_tip:
+                continue
+            tip_coverage = max(coverage(G.nodes[n]) for n, _ in chain)
+            if tip_coverage <= coverage(G.nodes[junction[0]]):
+                removed.update(n for n, _ in chain)
+    G.remove_nodes_from(removed)
+    return len(removed)
+
+
+def path_coverage(G, path, coverage):
+    return sum(coverage(G.nodes[n]) for n, _ in path) / len(path)
+
+
+def pop_bubbles(G, max_bubble, coverage=read_coverage):
+    # Tour-bus style: a bounded breadth-first search from every branching
+    # node[ori] keeps one path to each node it reaches. A second path to the
+    # same node closes a bubble; the branches after the two paths diverge
+    # may hold at most max_bubble nodes each and may be entered from other
+    # nodes too. The worse covered branch is removed; a direct link is
+    # scored with the coverage of the nodes it joins and is never removed.
+    removed = set()
+    def alive(path):
+        return path is not None and not any(n in removed for n, _ in path)
+    
+    for node in list(G.nodes):
+        for ori in '+-':
+            if node in removed:
+                break
+            if degree(n for n, _ in successors(G, node, ori) if n not in removed) < 2:
+                continue
+            
+            reached = {(node, ori): ()}; frontier = [(node, ori)]
+            for _ in range(max_bubble + 1):
+                next_frontier = []
+                for step in frontier:
+                    path = reached[step]
+                    if not alive(path):
+                        continue
+                    for nxt in successors(G, *step):
+                        if nxt[0] == node or nxt[0] in removed or any(n == nxt[0] for n, _ in path):
+                            continue
+                        new = path + (nxt,); old = reached.get(nxt)
+                        if not alive(old):
+                            reached[nxt] = new
+                            if len(new) <= max_bubble:
+                                next_frontier.append(nxt)
+                            continue
+                        
+                        # Branches of the two paths between where they diverge and nxt
+                        i = 0
+                        while old[i] == new[i]:
+                            i += 1
+                        branch1 = old[i:-1]; branch2 = new[i:-1]
+                        nodes1 = {n for n, _ in branch1}; nodes2 = {n for n, _ in branch2}
+                        if nodes1 & nodes2 or nxt[0] in nodes1 | nodes2:
+                            continue
+                        
+                        fork = old[i-1][0] if i > 0 else node
+                        flank = min(coverage(G.nodes[fork]), coverage(G.nodes[nxt[0]]))
+                        coverage1 = path_coverage(G, branch1, coverage) if branch1 else flank
+                        coverage2 = path_coverage(G, branch2, coverage) if branch2 else flank
+                        if coverage2 > coverage1 and branch1:
+                            removed.update(nodes1); reached[nxt] = new
+                            if len(new) <= max_bubble:
+                                next_frontier.append(nxt)
+                        elif coverage2 <= coverage1 and branch2:
+                            removed.update(nodes2)
+                frontier = next_frontier
+    G.remove_nodes_from(removed)
+    return len(removed)
+
+
+def correct_graph(G, min_coverage=2, max_tip=5, max_bubble=5, rounds=3, coverage=read_coverage):
+    for _ in range(rounds):
+        pruned = prune_low_coverage(G, min_coverage, coverage)
+        clipped = clip_tips(G, max_tip, coverage)
+        popped = pop_bubbles(G, max_bubble, coverage)
+        logging.info(f"Error correction: removed {pruned} low-coverage, {clipped} tip and {popped} bubble nodes")
+        if not pruned and not clipped and not popped:
+            break
+    return G
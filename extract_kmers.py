@@ -1,6 +1,13 @@
 import sys, logging
 import argparse
+import heapq
 import json
+import os
+import pickle
+import zlib
+from multiprocessing import Pool, Process, Queue
+from array import array
+from collections import deque, ChainMap, Counter
 
 level = logging.INFO
 
@@ -15,255 +22,741 @@ else:
 
 
 import networkx as nx
+from read_index import write_read_index
+from graph_io import open_output, save_graph_npz
+from bidirected import FLIP, reverse_complement
+from unitigs import compact_unitigs
+from correction import correct_graph
+from assembly import find_walks, write_walks
+from instrumentation import Report
+from parsers import map_file, open_input, fastq_index, indexed_sequence, read_fastq
 #from math import floor, ceil
 #from math import sqrt, cbrt
 #from matplotlib import pyplot as plt
 
-G = nx.DiGraph()
-node_IDs = {}
-NODE_ID = 1
+LANE = 32
+LANE_MASK = (1 << LANE) - 1
+STATE_VERSION = 1
 
 
 def build_gene_database(fastq_file):
-    genes = {}
-    with open(fastq_file) as file:
+    return {name: str(sequence, 'ascii') for name, sequence in read_fastq(fastq_file)}
+
+
+def index_gene_database(fastq_file, buffer=None):
+    # buffer: the mapped (or decompressed) FASTQ, if the caller has it already
+    index_file = f"{fastq_file}.fai"
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(fastq_file):
+        index = {}
+        with open(index_file) as file:
+            for line in file:
+                name, length, offset, line_bases, line_width = line.split('\t')[:5]
+                index[name] = (int(offset), int(length), int(line_bases), int(line_width))
+        return index
+    
+    logging.info(f"Indexing {fastq_file}")
+    index = {}
+    try:
+        with open(f"{index_file}.tmp", 'w') as fout:
+            for name, length, offset, line_bases, line_width, quality in fastq_index(map_file(fastq_file) if buffer is None else buffer):
+                index[name] = (offset, length, line_bases, line_width)
+                fout.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\t{quality}\n")
+    except BaseException:
+        # A malformed FASTQ leaves no partial index behind
+        if os.path.exists(f"{index_file}.tmp"):
+            os.remove(f"{index_file}.tmp")
+        raise
+    
+    os.replace(f"{index_file}.tmp", index_file)
+    return index
+
+
+class GeneDatabase:
+    def __init__(self, fastq_file):
+        # A compressed FASTQ is decompressed once, for the index and the sequences
+        self.buffer = map_file(fastq_file)
+        self.index = index_gene_database(fastq_file, self.buffer)
+        self.view = memoryview(self.buffer)
+    
+    def __contains__(self, name):
+        return name in self.index
+    
+    def __iter__(self):
+        return iter(self.index)
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def sequence(self, name):
+        return indexed_sequence(self.view, *self.index[name])
+    
+    def __getitem__(self, name):
+        return str(self.sequence(name), 'ascii')
+
+
+def stream_gene_calls(json_file, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open_input(json_file, 'r') as file:
+        buffer = ''; pos = 0; eof = False
         
-        while (line := file.readline()):
-            if line.startswith("@"):
-                 name = line.split()[0][1:]
-            else:
-                logging.error("Error: unexpected line in FASTQ file")
-                exit(1)
-            
-            line = file.readline()
-            sequence = line.strip()
-            
-            line = file.readline()
-            if line.startswith("+"):
-                 pass
-            else:
-                logging.error("Error: unexpected line in FASTQ file")
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = file.read(chunk_size)
+            buffer = buffer[pos:] + chunk; pos = 0
+            eof = not chunk
+        
+        def expect(tokens):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                fill()
+            if pos == len(buffer) or buffer[pos] not in tokens:
+                logging.error("Error: unexpected token in JSON file")
                 exit(1)
+            return buffer[pos]
+        
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value
+                except json.JSONDecodeError:
+                    if eof: raise
+                fill()
+        
+        expect('{'); pos += 1
+        token = expect('"}')
+        while token == '"':
+            read = decode()
+            expect(':'); pos += 1
+            expect('['); genes = decode()
+            yield read, genes
             
-            line = file.readline()
-            genes[name] = sequence
-    return genes
+            token = expect(',}'); pos += 1
+            if token == ',':
+                token = expect('"')
 
 
-def reverse_complement(seq):
-    translation_table = str.maketrans('ATCG', 'TAGC')
-    return seq.translate(translation_table)[::-1]
+def checked_gene_calls(json_file, gene_calls):
+    # A truncated or corrupt JSON found while streaming ends the run like any parse error
+    try:
+        yield from gene_calls
+    except (ValueError, EOFError, zlib.error) as error:
+        logging.error(f"Error: {json_file}: {error}")
+        exit(1)
 
 
-def normalize_node(genes, sequence):
-    fw = 0; rv = 0
-    for gene in genes:
-        if gene[0] == '+': fw += 1
-        elif gene[0] == '-': rv += 1
+def intern_genes(gene_list, gene_names=(None,)):
+    # Names already in gene_names keep their IDs, so k-mer codes of a
+    # persisted graph stay valid; only genes with a sequence are encoded
+    gene_names = list(gene_names)
+    IDs = {name: ID for ID, name in enumerate(gene_names)}
+    gene_IDs = {}
+    for name in gene_list:
+        if name not in IDs:
+            IDs[name] = len(gene_names)
+            gene_names.append(name)
+        gene_IDs[name] = IDs[name]
+    return gene_IDs, gene_names
+
+
+def encode_gene(gene_IDs, gene):
+    ID = gene_IDs.get(gene[1:])
+    if ID is None:
+        return None
+    return ID << 1 | (gene[0] == '-')
+
+
+class GeneTable:
+    def __init__(self, gene_list, gene_names):
+        self.gene_list = gene_list
+        self.gene_names = gene_names
+        self.sequences = [None] * (2 * len(gene_names))
     
-    reverse = None
+    def __getitem__(self, code):
+        sequence = self.sequences[code]
+        if sequence is None:
+            forward = self.gene_list[self.gene_names[code >> 1]]
+            self.sequences[code & ~1] = forward
+            self.sequences[code | 1] = reverse_complement(forward)
+            sequence = self.sequences[code]
+        return sequence
+
+
+def decode_kmer(gene_names, code, k):
+    genes = []
+    for _ in range(k):
+        gene = code & LANE_MASK; code >>= LANE
+        genes.append(f"{'-' if gene & 1 else '+'}{gene_names[gene >> 1]}")
+    return genes[::-1]
+
+
+def normalize_node(genes, fw_code, rv_code, fw):
+    rv = len(genes) - fw
     if fw < rv:
-        reverse = True
+        return rv_code, True
     elif fw > rv:
-        reverse = False
-    else:
-        for i in range(len(genes)):
-            if genes[i][0] == '-' and genes[-i-1][0] == '-':
-                reverse = True; break
-            elif genes[i][0] == '+' and genes[-i-1][0] == '+':
-                reverse = False; break
-    
-    if reverse == None:
-        fw_seq = sequence
-        rv_seq = reverse_complement(sequence)
-        if fw_seq > rv_seq:
-            reverse = True
-        elif fw_seq < rv_seq:
-            reverse = False
-        else:
-            logging.warning("Warning: unexpected k-mer node detected")
-    
-    if reverse:
-        canon = genes[::-1]
-        for i in range(len(canon)):
-            if canon[i][0] == '+': canon[i] = f"-{canon[i][1:]}"
-            elif canon[i][0] == '-': canon[i] = f"+{canon[i][1:]}"
-        sequence = reverse_complement(sequence)
-    else:
-        canon = genes[:]
+        return fw_code, False
+    
+    for i in range((len(genes) + 1) // 2):
+        if genes[i] & genes[-i-1] & 1:
+            return rv_code, True
+        elif not (genes[i] | genes[-i-1]) & 1:
+            return fw_code, False
     
-    return tuple(canon), sequence
+    if fw_code <= rv_code:
+        return fw_code, False
+    else:
+        return rv_code, True
 
 
-def normalize_edge(ID1, genes1, sequence1, ID2, genes2, sequence2):
-    if genes1[1:] == genes2[:-1]:
+def normalize_edge(ID1, code1, reverse1, ID2, code2, reverse2):
+    if not reverse1 and not reverse2:
         return (ID1, '+', ID2, '+')
-    elif genes2[1:] == genes1[:-1]:
+    elif reverse1 and reverse2:
         return (ID2, '+', ID1, '+')
+    elif not reverse1:
+        if code1 <= code2:
+            return (ID1, '+', ID2, '-')
+        else:
+            return (ID2, '+', ID1, '-')
     else:
-        for i in range(1, len(genes1)):
-            if genes1[i][0] == genes2[-i][0] or genes1[i][1:] != genes2[-i][1:]:
-                break
+        if code1 <= code2:
+            return (ID1, '-', ID2, '+')
         else:
-            fw_seq = sequence1 + reverse_complement(sequence2)
-            rv_seq = sequence2 + reverse_complement(sequence1)
-            if fw_seq < rv_seq:
-                return (ID1, '+', ID2, '-')
-            elif fw_seq > rv_seq:
-                return (ID2, '+', ID1, '-')
-            else:
-                logging.error("Error: unexpected k-mer edge detected")
-                exit(1)
-        
-        for i in range(len(genes2)-1):
-            if genes1[-i-2][0] == genes2[i][0] or genes1[-i-2][1:] != genes2[i][1:]:
-                break
+            return (ID2, '-', ID1, '+')
+
+
+def path_genes(G, gene_names, k, path):
+    genes = []
+    for node, ori in path:
+        kmer = decode_kmer(gene_names, G.nodes[node]['KMER'], k)
+        if ori == '-':
+            kmer = [f"{FLIP[gene[0]]}{gene[1:]}" for gene in reversed(kmer)]
+        genes.extend(kmer[k-1:] if genes else kmer)
+    return genes
+
+
+def encode_read(genes, gene_IDs, missing):
+    codes = []
+    for gene in genes:
+        code = encode_gene(gene_IDs, gene)
+        if code is not None:
+            codes.append(code)
         else:
-            fw_seq = reverse_complement(sequence1) + sequence2
-            rv_seq = reverse_complement(sequence2) + sequence1
-            if fw_seq < rv_seq:
-                return (ID1, '-', ID2, '+')
-            elif fw_seq > rv_seq:
-                return (ID2, '-', ID1, '+')
-            else:
-                logging.error("Error: unexpected k-mer edge detected")
-                exit(1)
+            missing[gene[1:]] += 1
+    return codes
+
+
+def kmerize(codes, k):
+    KMER_MASK = (1 << LANE * k) - 1
+    TOP_SHIFT = LANE * (k - 1)
+    kmer_genes = deque()
+    fw_code = 0; rv_code = 0; fw = 0
+    
+    for code in codes:
+        kmer_genes.append(code)
+        fw_code = (fw_code << LANE | code) & KMER_MASK
+        rv_code = rv_code >> LANE | (code ^ 1) << TOP_SHIFT
+        fw += not code & 1
+        
+        if len(kmer_genes) == k:
+            kmer, reverse = normalize_node(kmer_genes, fw_code, rv_code, fw)
+            yield kmer, reverse, kmer_genes[k // 2] ^ reverse
+            fw -= not kmer_genes.popleft() & 1
+
 
+def add_node(G, node_IDs, gene_table, kmer, gene, reads):
+    NODE_ID = len(node_IDs) + 1
+    LEN = len(gene_table[gene])
+    G.add_node(NODE_ID, GENE=gene, KMER=kmer, LEN=LEN, LR=reads)
+    G.graph['L'] += LEN
+    G.graph['Cov'] += len(reads) * LEN
+    node_IDs[kmer] = NODE_ID
+    return NODE_ID
 
-parser = argparse.ArgumentParser(description="Extract gene k-mers from a FASTQ+JSON file.")
-##
-# File path arguments (required within the script)
-parser.add_argument("-f", "--fastq_file", help="Path to the FASTQ file")
-parser.add_argument("-g", "--json_file", help="Path to the JSON file")
-parser.add_argument("-o", "--output_file", help="Path to the Output file")
-##
-# Optional arguments
-parser.add_argument("-k", type=int, default=5, help="Number of consecutive genes per k-mer")
-##
-args = parser.parse_args()
 
-if not args.fastq_file or not args.json_file or not args.output_file:
-    logging.error("Error: Missing required arguments.")
-    logging.error("Usage: parser.py -f <fastq_file> -g <json_file> -o <output_file> [options]")
-    exit(1)
+def extend_node(G, NODE_ID, reads):
+    G.nodes[NODE_ID]['LR'].extend(reads)
+    G.graph['Cov'] += len(reads) * G.nodes[NODE_ID]['LEN']
 
 
-gene_list = build_gene_database(args.fastq_file)
+def add_edge(G, edge):
+    ID1, ori1, ID2, ori2 = edge
+    G.add_edge(ID1, ID2)
+    G.edges[ID1, ID2]["From"] = ori1
+    G.edges[ID1, ID2]["To"] = ori2
 
-with open(args.json_file, 'r') as file:
-    data = json.load(file)
-    for read, genes in data.items():
-        PREV_ID = 0; NEXT_ID = 0
-        kmer_genes = []; kmer_sequence = []
+
+def add_read(G, node_IDs, gene_table, read_ID, kmers):
+    PREV_ID = 0; prev_kmer = 0; prev_reverse = False
+    
+    for kmer, reverse, gene in kmers:
+        if kmer not in node_IDs:
+            add_node(G, node_IDs, gene_table, kmer, gene, array('I'))
         
-        for gene in genes:
-            gene_orientation = gene[0]
-            gene_name = gene[1:]
+        NEXT_ID = node_IDs[kmer]
+        node = G.nodes[NEXT_ID]; LR = node['LR']
+        if not LR or LR[-1] != read_ID:
+            LR.append(read_ID)
+            G.graph['Cov'] += node['LEN']
+        
+        if PREV_ID and not G.has_edge(PREV_ID, NEXT_ID)\
+                   and not G.has_edge(NEXT_ID, PREV_ID):
+            add_edge(G, normalize_edge(PREV_ID, prev_kmer, prev_reverse, NEXT_ID, kmer, reverse))
+        
+        PREV_ID = NEXT_ID; prev_kmer = kmer; prev_reverse = reverse
+
+
+def batch_reads(gene_calls, size, read_names):
+    batch = []
+    for read, genes in gene_calls:
+        batch.append((len(read_names), genes))
+        read_names.append(read)
+        if len(batch) == size:
+            yield batch; batch = []
+    if batch:
+        yield batch
+
+
+def init_worker(ks, gene_IDs, queues):
+    global worker_args
+    worker_args = (ks, gene_IDs, queues)
+
+
+def kmerize_batch(batch_no, reads):
+    # Sends the k-mers and links of a batch, split by hash into one part per
+    # merge process, straight to the merge processes; each part holds flat
+    # arrays in order of first occurrence within the batch
+    ks, gene_IDs, queues = worker_args
+    parts = len(queues)
+    batch = {k: ({}, {}) for k in ks}
+    lengths = Counter(); missing = Counter()
+    
+    order = 0
+    for read_ID, genes in reads:
+        codes = encode_read(genes, gene_IDs, missing)
+        lengths[len(codes)] += 1
+        
+        for k, (nodes, edges) in batch.items():
+            prev_kmer = None; prev_reverse = False
             
-            if gene_name in gene_list:
-                kmer_genes.append(gene)
+            for kmer, reverse, gene in kmerize(codes, k):
+                node = nodes.get(kmer)
+                if node is None:
+                    nodes[kmer] = (order, gene, array('I', (read_ID,)))
+                elif node[2][-1] != read_ID:
+                    node[2].append(read_ID)
                 
-                gene_sequence = gene_list[gene_name]
-                if gene_orientation == '+':
-                    kmer_sequence.append(gene_sequence)
+                if prev_kmer is not None:
+                    pair = (prev_kmer, kmer) if prev_kmer <= kmer else (kmer, prev_kmer)
+                    if pair not in edges:
+                        edges[pair] = (order, prev_kmer, prev_reverse, kmer, reverse)
+                
+                prev_kmer = kmer; prev_reverse = reverse
+                order += 1
+    
+    data = [{} for _ in range(parts)]
+    for k, (nodes, edges) in batch.items():
+        split = [(array('I'), [], array('I'), array('I'), array('I'), array('I'), [], array('B')) for _ in range(parts)]
+        for kmer, (order, gene, LR) in nodes.items():
+            node_orders, kmers, genes, counts, reads, *_ = split[hash(kmer) % parts]
+            node_orders.append(order); kmers.append(kmer); genes.append(gene); counts.append(len(LR)); reads.extend(LR)
+        for pair, (order, kmer1, reverse1, kmer2, reverse2) in edges.items():
+            *_, edge_orders, pairs, reverse = split[hash(pair) % parts]
+            edge_orders.append(order); pairs += (kmer1, kmer2); reverse += array('B', (reverse1, reverse2))
+        for i in range(parts):
+            data[i][k] = split[i]
+    for queue, part in zip(queues, data):
+        queue.put((batch_no, part))
+    return lengths, missing
+
+
+def merge_part(queue, results, part):
+    # Merges one hash part of all batches, in any order: per k-mer the first
+    # occurrence (batch, position) and gene, and the read IDs of all batches;
+    # per link its first occurrence. Returns flat arrays sorted by first
+    # occurrence.
+    nodes = {}; edges = {}
+    while (item := queue.get()) is not None:
+        batch_no, data = item
+        for k, (node_orders, kmers, genes, counts, reads, edge_orders, pairs, reverse) in data.items():
+            k_nodes = nodes.setdefault(k, {}); k_edges = edges.setdefault(k, {})
+            start = 0
+            for order, kmer, gene, count in zip(node_orders, kmers, genes, counts):
+                key = batch_no << 32 | order
+                LR = reads[start:start+count]; start += count
+                node = k_nodes.get(kmer)
+                if node is None:
+                    k_nodes[kmer] = [key, gene, [LR]]
                 else:
-                    kmer_sequence.append(reverse_complement(gene_sequence))
-            else:
-                logging.warning(f"Warning: missing sequence for {gene_name}")
+                    if key < node[0]:
+                        node[0] = key; node[1] = gene
+                    node[2].append(LR)
+            for i, order in enumerate(edge_orders):
+                key = batch_no << 32 | order
+                pair = (pairs[2*i], pairs[2*i+1]) if pairs[2*i] <= pairs[2*i+1] else (pairs[2*i+1], pairs[2*i])
+                edge = k_edges.get(pair)
+                if edge is None or key < edge[0]:
+                    k_edges[pair] = (key, pairs[2*i], reverse[2*i], pairs[2*i+1], reverse[2*i+1])
+    
+    merged = {}
+    for k in nodes:
+        node_keys = array('Q'); kmers = []; genes = array('I'); counts = array('I'); reads = array('I')
+        for kmer, (key, gene, pieces) in sorted(nodes[k].items(), key=lambda item: item[1][0]):
+            node_keys.append(key); kmers.append(kmer); genes.append(gene)
+            # batches hold disjoint, increasing ranges of read IDs
+            pieces.sort(key=lambda LR: LR[0])
+            counts.append(sum(map(len, pieces)))
+            for LR in pieces:
+                reads.extend(LR)
+        merged[k] = ((node_keys, kmers, genes, counts, reads), sorted(edges[k].values()))
+    results.put((part, merged))
+
+
+def merged_nodes(node_keys, kmers, genes, counts, reads):
+    start = 0
+    for key, kmer, gene, count in zip(node_keys, kmers, genes, counts):
+        yield key, kmer, gene, reads[start:start+count]
+        start += count
+
+
+def add_reads_parallel(graphs, gene_table, read_names, gene_calls, gene_IDs, threads, lengths, missing,
+                       report, batch_size=1000):
+    # graphs: {k: (G, node_IDs)}, all filled from one pass over the reads.
+    # Workers k-merize batches; threads merge processes each own a hash part
+    # of the k-mers and links, so the parent only inserts distinct ones.
+    queues = [Queue(2 * threads) for _ in range(threads)]; results = Queue()
+    merges = [Process(target=merge_part, args=(queue, results, part), daemon=True)
+              for part, queue in enumerate(queues)]
+    for process in merges:
+        process.start()
+    
+    def merge(result):
+        batch_lengths, batch_missing = result
+        lengths.update(batch_lengths); missing.update(batch_missing)
+    
+    with report.stage('kmerize'), \
+         Pool(threads, initializer=init_worker, initargs=(list(graphs), gene_IDs, queues)) as pool:
+        pending = deque()
+        for batch_no, reads in enumerate(batch_reads(gene_calls, batch_size, read_names)):
+            pending.append(pool.apply_async(kmerize_batch, (batch_no, reads)))
+            if len(pending) > 2 * threads:
+                merge(pending.popleft().get())
+        while pending:
+            merge(pending.popleft().get())
+        # workers exit normally so that their queued parts are flushed
+        pool.close(); pool.join()
+    
+    with report.stage('merge'):
+        for queue in queues:
+            queue.put(None)
+        parts = [None] * threads
+        for _ in range(threads):
+            part, merged = results.get()
+            parts[part] = merged
+        for process in merges:
+            process.join()
+    
+    # Number nodes and insert links in order of first occurrence, as in a
+    # serial run, in one pass over the parts merged by first occurrence
+    with report.stage('edges'):
+        for k, (G, node_IDs) in graphs.items():
+            for _, kmer, gene, reads in heapq.merge(*(merged_nodes(*part[k][0]) for part in parts if k in part)):
+                if kmer in node_IDs:
+                    extend_node(G, node_IDs[kmer], reads)
+                else:
+                    add_node(G, node_IDs, gene_table, kmer, gene, reads)
+            for _, kmer1, reverse1, kmer2, reverse2 in heapq.merge(*(part[k][1] for part in parts if k in part)):
+                ID1 = node_IDs[kmer1]; ID2 = node_IDs[kmer2]
+                if not G.has_edge(ID1, ID2) and not G.has_edge(ID2, ID1):
+                    add_edge(G, normalize_edge(ID1, kmer1, reverse1, ID2, kmer2, reverse2))
+
+
+def k_path(path, k, multi):
+    # Output path for the graph of one k
+    if '{k}' in path:
+        return path.replace('{k}', str(k))
+    if not multi:
+        return path
+    root, ext = os.path.splitext(path)
+    if ext in ('.gz', '.bgz'):
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}.k{k}{ext}"
+
+
+def save_state(state_file, k, G, node_IDs, gene_table, read_names):
+    # Everything needed to append reads later: the uncorrected graph with its
+    # coverage totals, the k-mer -> node table, interned gene names and the
+    # sequences of all genes that label a node
+    genes = {}
+    for _, attr in G.nodes(data=True):
+        name = gene_table.gene_names[attr['GENE'] >> 1]
+        if name not in genes:
+            genes[name] = gene_table[attr['GENE'] & ~1]
+    state = {'version': STATE_VERSION, 'k': k, 'graph': G, 'node_IDs': node_IDs,
+             'gene_names': gene_table.gene_names, 'genes': genes, 'read_names': read_names}
+    try:
+        with open(f"{state_file}.tmp", 'wb') as fout:
+            pickle.dump(state, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        if os.path.exists(f"{state_file}.tmp"):
+            os.remove(f"{state_file}.tmp")
+        raise
+    os.replace(f"{state_file}.tmp", state_file)
+
+
+def load_state(state_file):
+    with open(state_file, 'rb') as file:
+        state = pickle.load(file)
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        logging.error(f"Error: {state_file} is not a graph state file")
+        exit(1)
+    return state
+
+
+def write_graph(args, k, multi, G, gene_table, read_names, report):
+    gene_names = gene_table.gene_names
+    
+    if args.correct:
+        with report.stage('correct', k=k):
+            correct_graph(G, args.min_reads, args.max_tip or k, args.max_bubble or k)
+    
+    with report.stage('coverage', k=k):
+        if args.correct:
+            L = 0; Cov = 0
+            for node_id, attr in G.nodes(data=True):
+                LEN = attr.get('LEN', 0)
+                LR = attr.get('LR', [])
+                XCov = len(LR) * LEN
+                L += LEN; Cov += XCov
+        else:
+            L = G.graph['L']; Cov = G.graph['Cov']
+        # Correction may remove every node; the empty graph is still written
+        if not L:
+            logging.warning(f"Warning: the graph for k={k} is empty{' after correction' if args.correct else ''}")
+        AvgCov = Cov / L if L else 0
+        
+        for node_id, attr in G.nodes(data=True):
+            LEN = attr.get('LEN', 0)
+            LR = attr.get('LR', [])
+            XCov = len(LR) * LEN
+            XAvgCov = XCov / LEN if LEN > 0 else 0
+            XNormCov = XAvgCov / AvgCov if AvgCov else 0
+            G.nodes[node_id]['DP'] = XNormCov
+    
+    def sequence(node_id, attr):
+        return gene_table[attr['GENE']]
+    def label(node_id, attr):
+        return f"[{','.join(decode_kmer(gene_names, attr['KMER'], k))}]"
+    
+    if args.unitigs:
+        with report.stage('unitigs', k=k):
+            K = G; G = compact_unitigs(K, sequence)
+        logging.info(f"Compacted {K.number_of_nodes()} nodes into {G.number_of_nodes()} unitigs")
+        report.count(f"k{k}.unitigs", G.number_of_nodes())
+        
+        def sequence(node_id, attr):
+            return attr['SEQ']
+        def label(node_id, attr):
+            return f"[{','.join(path_genes(K, gene_names, k, attr['PATH']))}]"
+    
+    
+    with report.stage('write', k=k):
+        with open_output(k_path(args.output_file, k, multi), args.compression) as fout:
+            fout.write("H\n")
             
-            if len(kmer_genes) == args.k:
-                kmer, sequence = normalize_node(kmer_genes, kmer_sequence[args.k // 2])
-                
-                if kmer not in node_IDs:
-                    G.add_node(NODE_ID)
-                    G.nodes[NODE_ID]['SEQ'] = sequence
-                    G.nodes[NODE_ID]['KMER'] = kmer
-                    G.nodes[NODE_ID]['LEN'] = len(sequence)
-                    G.nodes[NODE_ID]['LR'] = set()
-                    node_IDs[kmer] = NODE_ID; NODE_ID += 1
-                
-                NEXT_ID = node_IDs[kmer]
-                G.nodes[NEXT_ID]['LR'].add(read)
-                
-                if PREV_ID and not G.has_edge(PREV_ID, NEXT_ID)\
-                           and not G.has_edge(NEXT_ID, PREV_ID):
-                    
-                    prev_kmer = G.nodes[PREV_ID]['KMER']
-                    prev_sequence = G.nodes[PREV_ID]['SEQ']
-                    ID1, ori1, ID2, ori2 = normalize_edge(PREV_ID, prev_kmer, prev_sequence, NEXT_ID, kmer, sequence)
-                    G.add_edge(ID1, ID2)
-                    G.edges[ID1, ID2]["From"] = ori1
-                    G.edges[ID1, ID2]["To"] = ori2
+            # Write sequences
+            for node_id, attr in G.nodes(data=True):
+                SEQ = sequence(node_id, attr)
+                KMER = label(node_id, attr)
+                LEN = attr.get('LEN', '')
+                DP = attr.get('DP', '')
+                LR = attr.get('LR', [])
                 
-                PREV_ID = NEXT_ID; NEXT_ID = 0
-                del kmer_genes[0]; del kmer_sequence[0]
-
-
-L = 0; Cov = 0
-for node_id, attr in G.nodes(data=True):
-    LEN = attr.get('LEN', 0)
-    LR = attr.get('LR', set())
-    XCov = len(LR) * LEN
-    L += LEN; Cov += XCov
-AvgCov = Cov / L
-
-for node_id, attr in G.nodes(data=True):
-    LEN = attr.get('LEN', 0)
-    LR = attr.get('LR', set())
-    XCov = len(LR) * LEN
-    XAvgCov = XCov / LEN if LEN > 0 else 0
-    XNormCov = XAvgCov / AvgCov
-    G.nodes[node_id]['DP'] = XNormCov
-
-
-with open(args.output_file, 'w') as fout:
-    fout.write("H\n")
-    
-    # Write sequences
-    for node_id, attr in G.nodes(data=True):
-        SEQ = attr.get('SEQ', '')
-        KMER = attr.get('KMER', tuple())
-        LEN = attr.get('LEN', '')
-        DP = attr.get('DP', '')
-        LR = attr.get('LR', set())
+                if args.counts:
+                    fout.write(f"S\t{node_id}\t{SEQ}\tGN:Z:{KMER}\tLN:i:{LEN}\tdp:f:{DP}\tRC:i:{len(LR)}\n")
+                else:
+                    LR = f"[{','.join(read_names[read_ID] for read_ID in LR)}]"
+                    fout.write(f"S\t{node_id}\t{SEQ}\tGN:Z:{KMER}\tLN:i:{LEN}\tdp:f:{DP}\tLR:Z:{LR}\n")
+            
+            # Write links
+            for u, v, attr in G.edges(data=True):
+                FROM = attr.get('From', '')
+                TO = attr.get('To', '')
+                CIGAR = attr.get('CIGAR', '')
+                fout.write(f"L\t{u}\t{FROM}\t{v}\t{TO}\t{CIGAR}\n")
+        
+        if args.binary:
+            save_graph_npz(k_path(args.binary, k, multi), G, sequence, label)
         
-        KMER = str(list(KMER)).replace("'", "").replace(' ', '')
-        LR = str(list(LR)).replace("'", "").replace(' ', '')
-        fout.write(f"S\t{node_id}\t{SEQ}\tGN:Z:{KMER}\tLN:i:{LEN}\tdp:f:{DP}\tLR:Z:{LR}\n")
-    
-    # Write links
-    for u, v, attr in G.edges(data=True):
-        FROM = attr.get('From', '')
-        TO = attr.get('To', '')
-        CIGAR = attr.get('CIGAR', '')
-        fout.write(f"L\t{u}\t{FROM}\t{v}\t{TO}\t{CIGAR}\n")
-
-
-# Position nodes
-components = list(nx.weakly_connected_components(G))
-components = sorted(components, key=lambda x: -len(x))
-num_components = len(components)
-logging.info(f"Number of connected components: {num_components}")
-
-"""
-num_pages = floor(cbrt(num_components))
-num_plots = ceil(num_components/num_pages)
-num_rows = floor(sqrt(num_plots))
-num_columns = ceil(num_plots/num_rows)
-logging.info('\n')
-
-for i in range(num_pages):
-    logging.info(f"Page: {i+1}/{num_pages}")
-    fig, axes = plt.subplots(num_rows, num_columns)
-    axes = axes.flatten()[:num_plots]
-
-    for j in range(num_plots):
-        if i*num_plots+j == num_components: break
-        subgraph = nx.induced_subgraph(G, components[i*num_plots+j])
-        layout = nx.kamada_kawai_layout(subgraph)
-        nx.draw(subgraph, layout, ax=axes[j], with_labels=False)
-
-    plt.show()
-    logging.info('\r')
-logging.info('\n')
-"""
+        if args.read_index:
+            write_read_index(k_path(args.read_index, k, multi), read_names, ((node_id, attr['LR']) for node_id, attr in G.nodes(data=True)))
+    
+    
+    if args.walks:
+        with report.stage('walks', k=k):
+            write_walks(k_path(args.walks, k, multi), find_walks(G, args.threads, max_nodes=args.walk_nodes, time_budget=args.walk_time))
+    
+    
+    # Position nodes
+    components = list(nx.weakly_connected_components(G))
+    components = sorted(components, key=lambda x: -len(x))
+    num_components = len(components)
+    logging.info(f"Number of connected components: {num_components}")
+    
+    """
+    num_pages = floor(cbrt(num_components))
+    num_plots = ceil(num_components/num_pages)
+    num_rows = floor(sqrt(num_plots))
+    num_columns = ceil(num_plots/num_rows)
+    logging.info('\n')
+
+    for i in range(num_pages):
+        logging.info(f"Page: {i+1}/{num_pages}")
+        fig, axes = plt.subplots(num_rows, num_columns)
+        axes = axes.flatten()[:num_plots]
+
+        for j in range(num_plots):
+            if i*num_plots+j == num_components: break
+            subgraph = nx.induced_subgraph(G, components[i*num_plots+j])
+            layout = nx.kamada_kawai_layout(subgraph)
+            nx.draw(subgraph, layout, ax=axes[j], with_labels=False)
+
+        plt.show()
+        logging.info('\r')
+    logging.info('\n')
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract gene k-mers from a FASTQ+JSON file.")
+  ##
+    # File path arguments (required within the script)
+    parser.add_argument("-f", "--fastq_file", help="Path to the FASTQ file (may be gzip/bgzip-compressed)")
+    parser.add_argument("-g", "--json_file", help="Path to the JSON file (may be gzip/bgzip-compressed)")
+    parser.add_argument("-o", "--output_file", help="Path to the Output file")
+  ##
+    # Optional arguments
+    parser.add_argument("-k", type=int, nargs='+', default=[5], help="Number of consecutive genes per k-mer; with several values one graph is built per k ('{k}' in output paths is replaced by k, otherwise '.k<k>' is inserted before the extension)")
+    parser.add_argument("-x", "--index", action='store_true', default=False, help="Access the FASTQ file through a memory-mapped offset index (<fastq_file>.fai); a compressed FASTQ is decompressed into memory")
+    parser.add_argument("-s", "--stream", action='store_true', default=False, help="Parse the JSON file read by read instead of loading it at once")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of worker processes for k-mer extraction; as many more merge their results")
+    parser.add_argument("-c", "--counts", action='store_true', default=False, help="Write read counts (RC:i) instead of read names (LR:Z) to the GFA")
+    parser.add_argument("-r", "--read_index", help="Path to a binary read-to-node index to write")
+    parser.add_argument("-z", "--compression", choices=["gzip", "bgzip"], help="Compress the GFA output")
+    parser.add_argument("-b", "--binary", help="Path to a binary graph (.npz) to write")
+    parser.add_argument("-u", "--unitigs", action='store_true', default=False, help="Merge non-branching paths into unitigs before writing")
+    parser.add_argument("-e", "--correct", action='store_true', default=False, help="Clip tips, pop bubbles and prune low-coverage nodes")
+    parser.add_argument("--min_reads", type=int, default=2, help="Minimum number of supporting reads per node (with -e)")
+    parser.add_argument("--max_tip", type=int, help="Maximum tip length in nodes (with -e, default: k)")
+    parser.add_argument("--max_bubble", type=int, help="Maximum bubble branch length in nodes (with -e, default: k)")
+    parser.add_argument("-w", "--walks", help="Path to a TSV file of candidate plasmid walks to write")
+    parser.add_argument("--walk_time", type=float, default=60, help="Walk search time budget per component in seconds")
+    parser.add_argument("--walk_nodes", type=int, default=100000, help="Skip the walk search in components with more nodes")
+    parser.add_argument("-p", "--state", help="Path to a persisted graph state to write (or to update with -a)")
+    parser.add_argument("-a", "--append", action='store_true', default=False, help="Add the reads to the graph in the state file instead of starting a new one")
+    parser.add_argument("--report", help="Path to a JSON report of stage times, peak memory and counters to write")
+    parser.add_argument("--profile", help="Path to a cProfile dump of the run to write")
+  ##
+    args = parser.parse_args()
+    
+    if not args.fastq_file or not args.json_file or not args.output_file:
+        logging.error("Error: Missing required arguments.")
+        logging.error("Usage: parser.py -f <fastq_file> -g <json_file> -o <output_file> [options]")
+        exit(1)
+    if args.append and not args.state:
+        logging.error("Error: --append requires a state file (-p)")
+        exit(1)
+    report = Report("extract_kmers.py", args, profile=bool(args.profile))
+    
+    
+    with report.stage('parse'):
+        try:
+            if args.index:
+                gene_list = GeneDatabase(args.fastq_file)
+            else:
+                gene_list = build_gene_database(args.fastq_file)
+        except (ValueError, EOFError, zlib.error) as error:
+            logging.error(f"Error: {args.fastq_file}: {error}")
+            exit(1)
+        
+        if args.stream:
+            gene_calls = checked_gene_calls(args.json_file, stream_gene_calls(args.json_file))
+        else:
+            try:
+                with open_input(args.json_file, 'r') as file:
+                    gene_calls = json.load(file).items()
+            except (ValueError, EOFError, zlib.error) as error:
+                logging.error(f"Error: {args.json_file}: {error}")
+                exit(1)
+    
+    ks = list(dict.fromkeys(args.k))
+    multi = len(ks) > 1
+    
+    if args.append:
+        for k in ks:
+            if not os.path.exists(k_path(args.state, k, multi)):
+                logging.error(f"Error: state file {k_path(args.state, k, multi)} not found (run without --append to start a new graph)")
+                exit(1)
+        with report.stage('load_state'):
+            states = {k: load_state(k_path(args.state, k, multi)) for k in ks}
+        state = states[ks[0]]
+        for k in ks:
+            if states[k]['k'] != k:
+                logging.error(f"Error: the graph in {k_path(args.state, k, multi)} was built with k={states[k]['k']}")
+                exit(1)
+            if states[k]['gene_names'] != state['gene_names'] or len(states[k]['read_names']) != len(state['read_names']):
+                logging.error("Error: the graphs in the state files were not built together")
+                exit(1)
+        graphs = {k: (states[k]['graph'], states[k]['node_IDs']) for k in ks}
+        read_names = state['read_names']
+        gene_list = ChainMap(*(states[k]['genes'] for k in ks), gene_list)
+        gene_IDs, gene_names = intern_genes(gene_list, state['gene_names'])
+        logging.info(f"Appending to the graphs from {len(read_names)} reads")
+    else:
+        graphs = {k: (nx.DiGraph(L=0, Cov=0), {}) for k in ks}
+        read_names = []
+        gene_IDs, gene_names = intern_genes(gene_list)
+    gene_table = GeneTable(gene_list, gene_names)
+    
+    # Genes are encoded once per read and shared by the graphs of all k;
+    # nodes and edges are built together unless the reads are split into batches
+    first_read = len(read_names)
+    lengths = Counter(); missing = Counter()
+    if args.threads > 1:
+        add_reads_parallel(graphs, gene_table, read_names, gene_calls, gene_IDs, args.threads, lengths, missing, report)
+    else:
+        with report.stage('kmerize'):
+            for read, genes in gene_calls:
+                read_names.append(read)
+                codes = encode_read(genes, gene_IDs, missing)
+                lengths[len(codes)] += 1
+                for k, (G, node_IDs) in graphs.items():
+                    add_read(G, node_IDs, gene_table, len(read_names) - 1, kmerize(codes, k))
+    
+    report.count('reads', len(read_names) - first_read)
+    report.count('genes', sum(length * n for length, n in lengths.items()))
+    report.add_missing(missing); report.log_missing()
+    
+    for k, (G, node_IDs) in graphs.items():
+        report.count(f"k{k}.kmers", sum((length - k + 1) * n for length, n in lengths.items() if length >= k))
+        report.count(f"k{k}.nodes", G.number_of_nodes())
+        report.count(f"k{k}.edges", G.number_of_edges())
+        if args.state:
+            with report.stage('save_state', k=k):
+                save_state(k_path(args.state, k, multi), k, G, node_IDs, gene_table, read_names)
+        if multi:
+            logging.info(f"k = {k}")
+        write_graph(args, k, multi, G, gene_table, read_names, report)
+    
+    report.finish(args.report, args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import gzip
+import struct
+import zlib
+
+CHUNK_SIZE = 1 << 20
+
+# BGZF (blocked gzip) as written by bgzip: gzip members of at most 64 KiB
+# with a 'BC' extra field holding the compressed block size
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class BgzfWriter:
+    def __init__(self, file, level=6):
+        self.file = file
+        self.level = level
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self.write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def write_block(self, block):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(block) + compressor.flush()
+        bsize = BGZF_HEADER.size + len(cdata) + 8
+        self.file.write(BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, bsize - 1))
+        self.file.write(cdata)
+        self.file.write(struct.pack('<II', zlib.crc32(block), len(block)))
+
+    def close(self):
+        if self.buffer:
+            self.write_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.file.write(BGZF_EOF)
+        self.file.close()
+
+
+class ChunkedWriter:
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.chunk = []; self.size = 0
+
+    def write(self, text):
+        self.chunk.append(text); self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunk:
+            self.file.write(''.join(self.chunk).encode())
+            self.chunk = []; self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(output_file, compression=None, chunk_size=CHUNK_SIZE):
+    if compression == 'gzip':
+        file = gzip.open(output_file, 'wb', compresslevel=6)
+    elif compression == 'bgzip':
+        file = BgzfWriter(open(output_file, 'wb'))
+    elif compression is None:
+        file = open(output_file, 'wb')
+    else:
+        raise ValueError(f"unknown compression: {compression}")
+    return ChunkedWriter(file, chunk_size)
+
+
+def pack_strings(strings):
+    import numpy as np
+    data = [s.encode() for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in data], out=offsets[1:])
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+def unpack_strings(data, offsets):
+    buffer = data.tobytes()
+    return [buffer[offsets[i]:offsets[i+1]].decode() for i in range(len(offsets) - 1)]
+
+
+def save_graph_npz(npz_file, G, sequence, label, columns=()):
+    # Column layout: one row per node in G order, one row per edge in G order;
+    # strings are stored as concatenated UTF-8 bytes plus offsets
+    import numpy as np
+    nodes = list(G.nodes(data=True))
+    edges = list(G.edges(data=True))
+
+    seq_data, seq_offsets = pack_strings(sequence(node_id, attr) for node_id, attr in nodes)
+    label_data, label_offsets = pack_strings(label(node_id, attr) for node_id, attr in nodes)
+    arrays = {
+        'node_id': np.array([node_id for node_id, _ in nodes], dtype=np.int64),
+        'node_len': np.array([attr.get('LEN', 0) for _, attr in nodes], dtype=np.int64),
+        'node_dp': np.array([attr.get('DP', 0.0) for _, attr in nodes], dtype=np.float64),
+        'node_reads': np.array([len(attr.get('LR', ())) for _, attr in nodes], dtype=np.int64),
+        'node_seq': seq_data, 'node_seq_offsets': seq_offsets,
+        'node_label': label_data, 'node_label_offsets': label_offsets,
+        'edge_u': np.array([u for u, _, _ in edges], dtype=np.int64),
+        'edge_v': np.array([v for _, v, _ in edges], dtype=np.int64),
+        'edge_from': np.array([attr.get('From') == '-' for _, _, attr in edges], dtype=np.bool_),
+        'edge_to': np.array([attr.get('To') == '-' for _, _, attr in edges], dtype=np.bool_),
+        'edge_overlap': np.array([int(attr['CIGAR'][:-1]) if attr.get('CIGAR') else -1
+                                  for _, _, attr in edges], dtype=np.int64),
+    }
+    for column in columns:
+        arrays[f'node_{column.lower()}'] = np.array([attr.get(column) for _, attr in nodes])
+    np.savez(npz_file, **arrays)
+
+
+def load_graph_npz(npz_file):
+    import numpy as np
+    import networkx as nx
+    arrays = np.load(npz_file)
+    sequences = unpack_strings(arrays['node_seq'], arrays['node_seq_offsets'])
+    labels = unpack_strings(arrays['node_label'], arrays['node_label_offsets'])
+    columns = [name for name in arrays.files if name.startswith('node_') and name not in
+               ('node_id', 'node_len', 'node_dp', 'node_reads', 'node_seq', 'node_seq_offsets',
+                'node_label', 'node_label_offsets')]
+
+    # A MultiDiGraph if two links join the same pair of nodes (compacted unitigs)
+    pairs = list(zip(arrays['edge_u'].tolist(), arrays['edge_v'].tolist()))
+    G = nx.MultiDiGraph() if len(set(pairs)) < len(pairs) else nx.DiGraph()
+    for i, node_id in enumerate(arrays['node_id'].tolist()):
+        G.add_node(node_id, SEQ=sequences[i], KMER=labels[i], LEN=int(arrays['node_len'][i]),
+                   DP=float(arrays['node_dp'][i]), RC=int(arrays['node_reads'][i]))
+        for name in columns:
+            G.nodes[node_id][name[5:].upper()] = arrays[name][i].item()
+
+    orientation = np.array(['+', '-'])
+    for u, v, ori1, ori2, overlap in zip(arrays['edge_u'].tolist(), arrays['edge_v'].tolist(),
+                                         orientation[arrays['edge_from'].astype(int)].tolist(),
+                                         orientation[arrays['edge_to'].astype(int)].tolist(),
+                                         arrays['edge_overlap'].tolist()):
+        G.add_edge(u, v, From=ori1, To=ori2, CIGAR=f"{overlap}M" if overlap >= 0 else '')
+    return G
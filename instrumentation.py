@@ -0,0 +1,144 @@
+import cProfile
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    # Peak resident set size in bytes of this process and its finished
+    # children (worker pools); ru_maxrss is in KiB on Linux, bytes on macOS
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def reset_peak_rss():
+    # Reset this process's high-water mark (VmHWM) to its current RSS; only
+    # Linux supports it, elsewhere stages report only max_rss_so_far
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def current_peak_rss():
+    # VmHWM in bytes: the peak RSS of this process since the last reset
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def children_rss():
+    if resource is None:
+        return 0
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale * resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+class Report:
+    def __init__(self, script, args=None, profile=False):
+        self.script = script
+        self.args = dict(vars(args)) if args is not None else {}
+        self.stages = []
+        self.counters = Counter()
+        self.missing = Counter()
+        self.start = time.perf_counter()
+        self.profiler = None
+        self.open_stages = []
+        self.max_rss = 0
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def fold_peak(self):
+        # Fold the high-water mark since the last reset into the run and all
+        # open stages; resetting it also resets ru_maxrss, so the run keeps
+        # its own maximum
+        peak = current_peak_rss()
+        if peak is None:
+            return False
+        self.max_rss = max(self.max_rss, peak)
+        for stage in self.open_stages:
+            stage['peak'] = max(stage['peak'], peak)
+        return True
+
+    def max_rss_so_far(self):
+        self.fold_peak()
+        rss = peak_rss()
+        return max(self.max_rss, rss) if rss is not None else self.max_rss or None
+
+    @contextmanager
+    def stage(self, name, **info):
+        # peak_rss is the peak of this stage alone: VmHWM is reset when the
+        # stage starts (open outer stages keep the peak so far), and worker
+        # processes that finished during the stage count as well; without
+        # /proc it is None. max_rss_so_far is the peak of the run so far.
+        measure = self.fold_peak() and reset_peak_rss()
+        stage = {'peak': 0, 'children': children_rss()}
+        self.open_stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            max_rss = self.max_rss_so_far()
+            self.open_stages.pop()
+            stage_peak = None
+            if measure:
+                children = children_rss()
+                stage_peak = max(stage['peak'], children if children > stage['children'] else 0)
+            self.stages.append({'stage': name, **info, 'seconds': seconds,
+                                'peak_rss': stage_peak, 'max_rss_so_far': max_rss})
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_missing(self, missing):
+        self.missing.update(missing)
+
+    def log_missing(self, limit=10):
+        # One warning for all missing genes instead of one per occurrence
+        if self.missing:
+            names = ', '.join(f"{name} ({n})" for name, n in self.missing.most_common(limit))
+            more = f", ... {len(self.missing) - limit} more" if len(self.missing) > limit else ""
+            logging.warning(f"Warning: missing sequence for {len(self.missing)} genes "
+                            f"({sum(self.missing.values())} occurrences): {names}{more}")
+
+    def summary(self):
+        return {'script': self.script, 'args': self.args,
+                'seconds': time.perf_counter() - self.start, 'peak_rss': self.max_rss_so_far(),
+                'stages': self.stages, 'counters': dict(self.counters),
+                'missing_genes': dict(self.missing.most_common())}
+
+    def write(self, report_file):
+        with open(report_file, 'w') as fout:
+            json.dump(self.summary(), fout, indent=2, default=str)
+            fout.write('\n')
+
+    def finish(self, report_file=None, profile_file=None):
+        # Dump the cProfile stats (view with python -m pstats) and the report
+        if self.profiler is not None:
+            self.profiler.disable()
+            if profile_file:
+                self.profiler.dump_stats(profile_file)
+            self.profiler = None
+        if report_file:
+            self.write(report_file)
+
@@ -0,0 +1,163 @@
+import argparse
+import http.client
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Batched NCBI E-utilities downloads: many IDs per efetch request, a bounded
+# number of concurrent requests under a shared rate limit, retries with
+# backoff, and one atomically written file per accession and format, so
+# files on disk are skipped and an interrupted download resumes where it
+# stopped.
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+EMAIL = "andreas_rempel@sfu.ca"
+RETRY_CODES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    # At most rate requests per second over all threads
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def efetch(ids, rettype, base_url=EUTILS_URL, email=EMAIL, api_key=None, limiter=None, retries=5, timeout=300):
+    params = {'db': 'nuccore', 'id': ','.join(ids), 'rettype': rettype, 'retmode': 'text', 'tool': 'PLASLR'}
+    if email:
+        params['email'] = email
+    if api_key:
+        params['api_key'] = api_key
+    data = urllib.parse.urlencode(params).encode()
+
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.wait()
+        try:
+            with urllib.request.urlopen(f"{base_url.rstrip('/')}/efetch.fcgi", data, timeout=timeout) as response:
+                return response.read().decode()
+        except urllib.error.HTTPError as error:
+            if error.code not in RETRY_CODES or attempt == retries:
+                raise
+            retry_after = error.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else 2 ** attempt
+        except (OSError, http.client.HTTPException):
+            if attempt == retries:
+                raise
+            delay = 2 ** attempt
+        time.sleep(min(delay, 60))
+
+
+def split_records(text, rettype):
+    # (accession.version, record) of each record of an efetch response
+    if rettype == 'fasta':
+        for record in re.split(r'(?m)^(?=>)', text):
+            if record.strip():
+                yield record[1:].split(None, 1)[0], record
+    else:
+        for record in re.split(r'(?m)^(?=LOCUS )', text):
+            match = re.search(r'(?m)^VERSION\s+(\S+)', record) or re.search(r'(?m)^ACCESSION\s+(\S+)', record)
+            if match:
+                yield match.group(1), record
+
+
+def write_atomic(path, text):
+    with open(f"{path}.tmp", 'w') as fout:
+        fout.write(text)
+    os.replace(f"{path}.tmp", path)
+
+
+def fetch_batch(ids, extension, output_dir, **options):
+    # Writes <id>.<extension> for every record of the batch and returns the
+    # IDs that NCBI returned no record for; IDs may be given with or
+    # without a version
+    requested = {}
+    for accession in ids:
+        requested.setdefault(accession, accession)
+        requested.setdefault(accession.split('.')[0], accession)
+
+    missing = dict.fromkeys(ids)
+    for version, record in split_records(efetch(ids, extension, **options), extension):
+        accession = requested.get(version) or requested.get(version.split('.')[0])
+        if accession in missing:
+            write_atomic(os.path.join(output_dir, f"{accession}.{extension}"), record)
+            del missing[accession]
+    return list(missing)
+
+
+def download(accessions, output_dir=".", formats=("gb", "fasta"), batch_size=100, concurrency=3, rate=None,
+             base_url=EUTILS_URL, email=EMAIL, api_key=None, retries=5):
+    # Returns the accessions that could not be downloaded in some format
+    limiter = RateLimiter(rate or (10 if api_key else 3))
+    options = dict(base_url=base_url, email=email, api_key=api_key, limiter=limiter, retries=retries)
+    os.makedirs(output_dir, exist_ok=True)
+
+    batches = []
+    for extension in formats:
+        todo = [accession for accession in accessions if not os.path.exists(os.path.join(output_dir, f"{accession}.{extension}"))]
+        print(f"{extension}: {len(accessions) - len(todo)} of {len(accessions)} files on disk", file=sys.stderr)
+        batches += [(extension, todo[i:i+batch_size]) for i in range(0, len(todo), batch_size)]
+
+    failed = []
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = {pool.submit(fetch_batch, batch, extension, output_dir, **options): (extension, batch)
+                   for extension, batch in batches}
+        for future in as_completed(futures):
+            extension, batch = futures[future]
+            try:
+                missing = future.result()
+            except (OSError, http.client.HTTPException) as error:
+                print(f"Error: {extension} batch {batch[0]}..{batch[-1]}: {error}", file=sys.stderr)
+                failed += batch
+                continue
+            for accession in missing:
+                print(f"Error: no {extension} record for {accession}", file=sys.stderr)
+            failed += missing
+            print(f"Downloaded {len(batch) - len(missing)} {extension} files ({batch[0]}..{batch[-1]})", file=sys.stderr)
+    return list(dict.fromkeys(failed))
+
+
+def main(accessions_file="accessions.txt"):
+    parser = argparse.ArgumentParser(description="Download the GenBank and Fasta files of all accessions from NCBI.")
+    parser.add_argument("-a", "--accessions", default=accessions_file, help="Path to the accession list")
+    parser.add_argument("-o", "--output_dir", default=".", help="Directory for the <accession>.gb and <accession>.fasta files")
+    parser.add_argument("-b", "--batch_size", type=int, default=100, help="Accessions per efetch request")
+    parser.add_argument("-j", "--concurrency", type=int, default=3, help="Number of concurrent requests")
+    parser.add_argument("--rate", type=float, help="Maximum requests per second (default: 3, or 10 with an API key)")
+    parser.add_argument("--retries", type=int, default=5, help="Retries per request after a network error or an HTTP 429/5xx response")
+    parser.add_argument("--base_url", default=EUTILS_URL, help="E-utilities base URL")
+    parser.add_argument("--email", default=EMAIL, help="Contact email sent to NCBI")
+    parser.add_argument("--api_key", default=os.environ.get("NCBI_API_KEY"), help="NCBI API key (default: $NCBI_API_KEY)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.accessions):
+        print("Error: Accessions file not found.")
+        exit(1)
+    with open(args.accessions) as infile:
+        accessions = list(dict.fromkeys(line.strip() for line in infile if line.strip()))
+
+    failed = download(accessions, args.output_dir, batch_size=args.batch_size, concurrency=args.concurrency,
+                      rate=args.rate, base_url=args.base_url, email=args.email, api_key=args.api_key,
+                      retries=args.retries)
+    if failed:
+        print(f"Error: {len(failed)} accessions failed; run again to retry them.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
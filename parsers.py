@@ -0,0 +1,457 @@
+import io
+import mmap
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from graph_io import BGZF_HEADER
+
+# Readers for the FASTA, FASTQ, GenBank and GFA inputs of the scripts. Files
+# are memory-mapped and scanned with find() on the whole buffer, so only the
+# fields that are used are copied; single-line sequences are returned as
+# memoryview slices of the mapped file, wrapped ones as joined bytes.
+#
+# gzip and BGZF (bgzip) files are read directly: they are decompressed in a
+# background thread while the records are parsed, and BGZF blocks are
+# inflated by a thread pool (zlib releases the GIL).
+
+CHUNK_SIZE = 1 << 20
+DECOMPRESS_THREADS = min(8, os.cpu_count() or 1)
+
+
+def compression(path):
+    # 'gzip', 'bgzip' or None, from the first bytes of the file
+    with open(path, 'rb') as file:
+        header = file.read(BGZF_HEADER.size)
+    if header[:2] != b'\x1f\x8b':
+        return None
+    if len(header) == BGZF_HEADER.size and header[3] & 4 and header[12:14] == b'BC':
+        return 'bgzip'
+    return 'gzip'
+
+
+def gzip_blocks(path, chunk_size=CHUNK_SIZE):
+    # Decompressed chunks of a gzip file of one or more members
+    with open(path, 'rb') as file:
+        decompressor = zlib.decompressobj(31); pending = False
+        while data := file.read(chunk_size):
+            while data:
+                block = decompressor.decompress(data); pending = True
+                if block:
+                    yield block
+                if not decompressor.eof:
+                    break
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31); pending = False
+        if pending:
+            raise EOFError("compressed file ended before the end-of-stream marker")
+
+
+def inflate_bgzf(blocks):
+    data = []
+    for block in blocks:
+        inflated = zlib.decompress(block[BGZF_HEADER.size:-8], -15)
+        if zlib.crc32(inflated) != int.from_bytes(block[-8:-4], 'little'):
+            raise ValueError("BGZF block with a wrong CRC")
+        data.append(inflated)
+    return b''.join(data)
+
+
+def bgzf_blocks(path, threads=DECOMPRESS_THREADS, group=16):
+    # Decompressed groups of BGZF blocks, inflated in parallel and returned in order
+    with open(path, 'rb') as file, ThreadPoolExecutor(threads) as pool:
+        futures = deque(); blocks = []
+        while header := file.read(BGZF_HEADER.size):
+            fields = BGZF_HEADER.unpack(header) if len(header) == BGZF_HEADER.size else ()
+            if fields[:2] != (0x1f, 0x8b) or fields[8:10] != (ord('B'), ord('C')):
+                raise ValueError(f"{path}: not a BGZF block at offset {file.tell() - len(header)}")
+            blocks.append(header + file.read(fields[-1] + 1 - BGZF_HEADER.size))
+            if len(blocks) == group:
+                futures.append(pool.submit(inflate_bgzf, blocks)); blocks = []
+                if len(futures) > 2 * threads:
+                    yield futures.popleft().result()
+        if blocks:
+            futures.append(pool.submit(inflate_bgzf, blocks))
+        while futures:
+            yield futures.popleft().result()
+
+
+class BackgroundReader(io.RawIOBase):
+    # Read-only file of the chunks of a generator that runs in a background thread
+    def __init__(self, chunks, prefetch=8):
+        self.queue = queue.Queue(prefetch)
+        self.stop = threading.Event()
+        self.chunk = b''; self.offset = 0; self.done = False
+        self.thread = threading.Thread(target=self.produce, args=(chunks,), daemon=True)
+        self.thread.start()
+
+    def produce(self, chunks):
+        # Always ends with None or the error, which close() waits for
+        try:
+            for chunk in chunks:
+                if self.stop.is_set():
+                    break
+                self.queue.put(chunk)
+        except BaseException as error:
+            self.queue.put(error)
+            return
+        self.queue.put(None)
+
+    def next_chunk(self):
+        if self.done:
+            return None
+        chunk = self.queue.get()
+        if isinstance(chunk, BaseException):
+            self.done = True
+            raise chunk
+        if chunk is None:
+            self.done = True
+        return chunk
+
+    def chunks(self):
+        # The remaining data chunk by chunk, without copying
+        if self.offset < len(self.chunk):
+            yield self.chunk[self.offset:]
+        self.chunk = b''; self.offset = 0
+        while (chunk := self.next_chunk()) is not None:
+            yield chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.chunk):
+            chunk = self.next_chunk()
+            if chunk is None:
+                return 0
+            self.chunk = chunk; self.offset = 0
+        n = min(len(buffer), len(self.chunk) - self.offset)
+        buffer[:n] = self.chunk[self.offset:self.offset+n]
+        self.offset += n
+        return n
+
+    def close(self):
+        self.stop.set()
+        while not self.done:
+            try:
+                self.next_chunk()
+            except Exception:
+                pass
+        super().close()
+
+
+def decompressed_chunks(path, kind):
+    return BackgroundReader(bgzf_blocks(path) if kind == 'bgzip' else gzip_blocks(path))
+
+
+def open_input(path, mode='rb'):
+    # open() for plain files; gzip and BGZF files are decompressed on the fly
+    kind = compression(path)
+    if kind is None:
+        return open(path, mode)
+    file = io.BufferedReader(decompressed_chunks(path, kind), CHUNK_SIZE)
+    return file if 'b' in mode else io.TextIOWrapper(file)
+
+
+def map_file(path):
+    # Whole file as a read-only buffer with find() and slicing: an mmap
+    # (pages are loaded on demand), the decompressed data of compressed
+    # files, or bytes for empty files
+    kind = compression(path)
+    if kind is not None:
+        buffer = bytearray()
+        with decompressed_chunks(path, kind) as reader:
+            for chunk in reader.chunks():
+                buffer += chunk
+        return buffer
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def record_chunks(path, separator):
+    # Parts of a file that end at a record boundary (before the last separator
+    # seen), so compressed files are parsed while they are decompressed
+    kind = compression(path)
+    if kind is None:
+        yield map_file(path)
+        return
+    rest = b''
+    with decompressed_chunks(path, kind) as reader:
+        for chunk in reader.chunks():
+            buffer = rest + chunk if rest else chunk
+            cut = buffer.rfind(separator)
+            if cut < 0:
+                rest = buffer
+                continue
+            yield buffer[:cut + 1]
+            rest = buffer[cut + 1:]
+    if rest:
+        yield rest
+
+
+def line_end(buffer, pos):
+    end = buffer.find(b'\n', pos)
+    return len(buffer) if end < 0 else end
+
+
+def strip_cr(buffer, start, end):
+    return end - 1 if end > start and buffer[end - 1] == 13 else end
+
+
+def find_line(buffer, prefix, pos=0):
+    # Start of the first line at or after pos that begins with prefix, or -1
+    if pos == 0 and buffer[:len(prefix)] == prefix:
+        return 0
+    found = buffer.find(b'\n' + prefix, max(pos - 1, 0))
+    return found + 1 if found >= 0 else -1
+
+
+def fasta_records(buffer):
+    # (header without '>', sequence) of each record; the sequence is found by
+    # one find() for the end of its first line, and only wrapped sequences
+    # are searched for the next header and joined
+    view = memoryview(buffer)
+    find = buffer.find
+    size = len(buffer)
+    start = find(b'>')
+    while start >= 0:
+        eol = find(b'\n', start)
+        if eol < 0:
+            eol = size
+        header = buffer[start+1:strip_cr(buffer, start + 1, eol)].decode()
+        seq = eol + 1
+        if seq >= size or buffer[seq] == 62:
+            yield header, view[seq:seq]
+            start = seq if seq < size else -1
+            continue
+
+        nl = find(b'\n', seq)
+        if nl < 0:
+            yield header, view[seq:strip_cr(buffer, seq, size)]
+            return
+        if nl + 1 == size or buffer[nl + 1] == 62:
+            yield header, view[seq:strip_cr(buffer, seq, nl)]
+            start = nl + 1 if nl + 1 < size else -1
+            continue
+
+        end = find(b'\n>', nl)
+        if end < 0:
+            end = size
+        yield header, bytes(view[seq:end]).replace(b'\r', b'').replace(b'\n', b'')
+        start = end + 1 if end < size else -1
+
+
+def read_fasta(fasta_file):
+    for buffer in record_chunks(fasta_file, b'\n>'):
+        yield from fasta_records(buffer)
+
+
+def fastq_index(buffer):
+    # .fai columns (name, length, offset, line bases, line width, quality
+    # offset) of each record; sequences may be wrapped over several lines
+    size = len(buffer)
+    pos = 0
+    while pos < size:
+        eol = line_end(buffer, pos)
+        if buffer[pos] != ord('@'):
+            raise ValueError("unexpected line in FASTQ file")
+        name = (buffer[pos+1:eol].split() or [b''])[0].decode()
+
+        offset = eol + 1
+        plus = buffer.find(b'\n+', eol)
+        if plus < 0:
+            raise ValueError("unexpected line in FASTQ file")
+        if plus == eol:
+            length = line_bases = line_width = 0
+        else:
+            first = min(line_end(buffer, offset), plus)
+            line_bases = strip_cr(buffer, offset, first) - offset
+            line_width = first + 1 - offset
+            if first == plus:
+                length = line_bases
+            else:
+                length = len(bytes(buffer[offset:plus]).replace(b'\r', b'').replace(b'\n', b''))
+
+        # Quality lines up to the length of the sequence
+        quality = pos = line_end(buffer, plus + 1) + 1
+        remaining = length
+        while True:
+            eol = line_end(buffer, pos)
+            remaining -= strip_cr(buffer, pos, eol) - pos
+            pos = eol + 1
+            if remaining <= 0:
+                break
+            if pos >= size:
+                raise ValueError("truncated quality in FASTQ file")
+        yield name, length, offset, line_bases, line_width, quality
+
+
+def indexed_sequence(view, offset, length, line_bases, line_width):
+    # Sequence of an .fai entry: a slice if it is on one line, joined bytes otherwise
+    if length <= line_bases:
+        return view[offset:offset+length]
+    lines, rest = divmod(length, line_bases)
+    end = offset + lines * line_width + rest
+    return bytes(view[offset:end]).replace(b'\r', b'').replace(b'\n', b'')
+
+
+def read_fastq(fastq_file):
+    # (name, sequence) of each record
+    buffer = map_file(fastq_file)
+    view = memoryview(buffer)
+    for name, length, offset, line_bases, line_width, _ in fastq_index(buffer):
+        yield name, indexed_sequence(view, offset, length, line_bases, line_width)
+
+
+def genbank_lines(buffer, start, end):
+    pos = start
+    while pos < end:
+        eol = line_end(buffer, pos)
+        yield buffer[pos:strip_cr(buffer, pos, eol)].decode()
+        pos = eol + 1
+
+
+def genbank_features(buffer):
+    # (key, location, qualifiers) of each feature in the FEATURES tables of all
+    # records; the sequence (ORIGIN) sections are skipped by find() instead of
+    # being split into lines. Qualifier values keep their quotes; a qualifier
+    # without a value is None.
+    size = len(buffer)
+    pos = find_line(buffer, b'FEATURES')
+    while pos >= 0:
+        # The table ends at the first line that is not indented
+        start = end = line_end(buffer, pos) + 1
+        while end < size and buffer[end] == 32:
+            end = line_end(buffer, end) + 1
+        end = min(end, size)
+
+        feature = None; qualifier = None
+        for line in genbank_lines(buffer, start, end):
+            if not line.strip():
+                continue
+            if line[5:6] != ' ':
+                if feature:
+                    yield feature
+                key, _, location = line.strip().partition(' ')
+                feature = (key, [location.strip()], {}); qualifier = None
+            elif not feature:
+                continue
+            elif line[21:22] == '/':
+                qualifier, equals, value = line[22:].partition('=')
+                feature[2][qualifier] = value if equals else None
+            elif qualifier is None:
+                feature[1].append(line.strip())
+            elif feature[2][qualifier] is not None:
+                separator = '' if qualifier == 'translation' else ' '
+                feature[2][qualifier] += separator + line.strip()
+        if feature:
+            yield feature
+
+        pos = find_line(buffer, b'FEATURES', end)
+
+
+def read_genbank_features(genbank_file):
+    # Features with the location as one string and unquoted qualifier values
+    for key, location, qualifiers in genbank_features(map_file(genbank_file)):
+        yield key, ''.join(location), {name: value.strip('"') if value is not None else None
+                                       for name, value in qualifiers.items()}
+
+
+def genbank_header(genbank_file):
+    # Header lines of the first record; reading stops at FEATURES (or ORIGIN
+    # or // for a record without features), so the features and the sequence
+    # are never read or decompressed
+    lines = []
+    with open_input(genbank_file, 'rt') as infile:
+        for line in infile:
+            if line.startswith(('FEATURES', 'ORIGIN', '//')):
+                break
+            lines.append(line.rstrip('\r\n'))
+    return lines
+
+
+def read_genbank_dblinks(genbank_file):
+    # DBLINK entries of the first record as {database: accessions}; an entry
+    # wrapped over several lines is joined
+    dblinks = {}; key = None; inside = False
+    for line in genbank_header(genbank_file):
+        if line.startswith('DBLINK'):
+            inside = True
+        elif not line.startswith(' ' * 12):
+            inside = False
+        if not inside:
+            continue
+        entry = line[12:].strip()
+        if ': ' in entry:
+            key, _, value = entry.partition(': ')
+            dblinks[key] = value
+        elif key is not None and entry:
+            dblinks[key] += ' ' + entry
+    return dblinks
+
+
+# GFA tags of extract_kmers.py and build_graph.py and the node attributes
+# they are written from
+GFA_TAGS = {'GN': 'KMER', 'LN': 'LEN', 'dp': 'DP', 'RC': 'RC', 'LR': 'LR', 'class': 'CLASS'}
+
+
+def gfa_value(tag, kind, value):
+    if tag == 'LR':
+        return value[1:-1].split(',') if value[1:-1] else []
+    if kind == 'i':
+        return int(value)
+    if kind == 'f':
+        return float(value)
+    return value
+
+
+def gfa_records(G, buffer, links):
+    node = lambda name: int(name) if name.isdigit() else name
+    pos = 0
+    size = len(buffer)
+    while pos < size:
+        eol = line_end(buffer, pos)
+        record = buffer[pos:pos+2]
+        if record == b'S\t':
+            fields = buffer[pos:strip_cr(buffer, pos, eol)].decode().split('\t')
+            attr = {'SEQ': fields[2]}
+            for field in fields[3:]:
+                tag, kind, value = field.split(':', 2)
+                if not value:
+                    continue
+                if tag == 'SEG':
+                    accession, _, coordinates = value.rpartition('@')
+                    start, _, end = coordinates.partition('-')
+                    attr['ACC'] = accession
+                    attr['START'] = int(start) if start.isdigit() else start
+                    attr['END'] = int(end) if end.isdigit() else end
+                else:
+                    attr[GFA_TAGS.get(tag, tag)] = gfa_value(tag, kind, value)
+            G.add_node(node(fields[1]), **attr)
+        elif record == b'L\t':
+            fields = buffer[pos:strip_cr(buffer, pos, eol)].decode().split('\t')
+            links.append((node(fields[1]), node(fields[3]), fields[2], fields[4],
+                          fields[5] if len(fields) > 5 else ''))
+        pos = eol + 1
+
+
+def read_gfa(gfa_file):
+    # DiGraph of the S and L lines (a MultiDiGraph if two links join the same
+    # pair of nodes, as in compacted unitig graphs), with the node attributes the GFA was
+    # written from (SEQ, KMER, LEN, DP, RC or LR as a list of read names,
+    # ACC/START/END from SEG, CLASS) and From/To/CIGAR on the edges.
+    # Tags without a value are left out; other tags keep their name.
+    import networkx as nx
+    G = nx.DiGraph(); links = []
+    for buffer in record_chunks(gfa_file, b'\n'):
+        gfa_records(G, buffer, links)
+    if len({(u, v) for u, v, *_ in links}) < len(links):
+        G = nx.MultiDiGraph(G)
+    for u, v, ori1, ori2, CIGAR in links:
+        G.add_edge(u, v, From=ori1, To=ori2, CIGAR=CIGAR)
+    return G
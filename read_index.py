@@ -0,0 +1,107 @@
+"""
+Binary read -> node index written by extract_kmers.py (-r/--read_index)
+
+Layout (little-endian):
+    magic b'PLRN', version (u32), number of reads (u64), number of entries (u64)
+    node offsets per read (u64, reads + 1)
+    node IDs (u32, entries), sorted per read
+    name offsets per read (u64, reads + 1)
+    read names (UTF-8, concatenated)
+
+Reads are sorted by name, so a read is found by binary search without
+loading the file; only the pages touched by a lookup are read.
+"""
+
+import mmap
+import struct
+from array import array
+
+MAGIC = b'PLRN'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+
+
+def write_read_index(index_file, read_names, node_reads):
+    # node_reads: iterable of (node ID, sorted array of read IDs)
+    node_reads = list(node_reads)
+    counts = array('Q', bytes(8 * (len(read_names) + 1)))
+    for _, reads in node_reads:
+        for read in reads:
+            counts[read + 1] += 1
+
+    order = sorted(range(len(read_names)), key=lambda read: read_names[read].encode())
+    rank = array('Q', bytes(8 * len(read_names)))
+    offsets = array('Q', [0])
+    for position, read in enumerate(order):
+        rank[read] = position
+        offsets.append(offsets[-1] + counts[read + 1])
+
+    nodes = array('I', bytes(4 * offsets[-1]))
+    fill = array('Q', offsets[:-1])
+    for node_id, reads in sorted(node_reads):
+        for read in reads:
+            position = rank[read]
+            nodes[fill[position]] = node_id
+            fill[position] += 1
+
+    names = [read_names[read].encode() for read in order]
+    name_offsets = array('Q', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    with open(index_file, 'wb') as fout:
+        fout.write(HEADER.pack(MAGIC, VERSION, len(read_names), len(nodes)))
+        offsets.tofile(fout)
+        nodes.tofile(fout)
+        name_offsets.tofile(fout)
+        fout.write(b''.join(names))
+
+
+class ReadIndex:
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_reads, self.num_entries = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{index_file} is not a read index")
+
+        view = memoryview(self.buffer)
+        start = HEADER.size
+        self.offsets = view[start:start + 8 * (self.num_reads + 1)].cast('Q')
+        start += 8 * (self.num_reads + 1)
+        self.nodes = view[start:start + 4 * self.num_entries].cast('I')
+        start += 4 * self.num_entries
+        self.name_offsets = view[start:start + 8 * (self.num_reads + 1)].cast('Q')
+        start += 8 * (self.num_reads + 1)
+        self.names = view[start:]
+
+    def __len__(self):
+        return self.num_reads
+
+    def name(self, position):
+        return bytes(self.names[self.name_offsets[position]:self.name_offsets[position + 1]]).decode()
+
+    def find(self, name):
+        key = name.encode(); lo = 0; hi = self.num_reads
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.names[self.name_offsets[mid]:self.name_offsets[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_reads and self.name(lo) == name:
+            return lo
+        return None
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def __getitem__(self, name):
+        position = self.find(name)
+        if position is None:
+            raise KeyError(name)
+        return self.nodes[self.offsets[position]:self.offsets[position + 1]]
+
+    def __iter__(self):
+        for position in range(self.num_reads):
+            yield self.name(position)
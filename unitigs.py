@@ -0,0 +1,83 @@
+from array import array
+
+import networkx as nx
+
+from bidirected import FLIP, reverse_complement, successors, predecessors, link, add_link, overlap
+
+
+def unique_successor(G, node, ori):
+    succ = None
+    for nxt in successors(G, node, ori):
+        if succ is not None:
+            return None
+        succ = nxt
+    if succ is None or succ[0] == node:
+        return None
+    
+    count = 0
+    for _ in predecessors(G, *succ):
+        count += 1
+        if count > 1:
+            return None
+    return succ
+
+
+def merge_reads(reads):
+    if all(isinstance(LR, array) for LR in reads):
+        merged = set()
+        for LR in reads:
+            merged.update(LR)
+        return array('I', sorted(merged))
+    return set().union(*reads)
+
+
+def compact_unitigs(G, sequence):
+    # Merge maximal non-branching paths of the bidirected graph G into
+    # unitigs; sequence(node_id, attr) returns the forward node sequence.
+    # Every node and link is visited a constant number of times.
+    visited = set(); paths = []
+    for node in G.nodes:
+        if node in visited:
+            continue
+        visited.add(node)
+        
+        forward = [(node, '+')]
+        while (nxt := unique_successor(G, *forward[-1])) and nxt[0] not in visited:
+            forward.append(nxt); visited.add(nxt[0])
+        
+        backward = [(node, '-')]
+        while (nxt := unique_successor(G, *backward[-1])) and nxt[0] not in visited:
+            backward.append(nxt); visited.add(nxt[0])
+        
+        paths.append([(n, FLIP[o]) for n, o in backward[:0:-1]] + forward)
+    
+    # Links between the same two unitigs can differ in orientation (e.g. a
+    # hairpin at each end of one unitig), so H is a MultiDiGraph
+    H = nx.MultiDiGraph(); position = {}
+    for unitig_id, path in enumerate(paths, 1):
+        parts = []; reads = []; LEN = 0; XCov = 0
+        for i, (node, ori) in enumerate(path):
+            attr = G.nodes[node]
+            SEQ = sequence(node, attr)
+            if ori == '-':
+                SEQ = reverse_complement(SEQ)
+            if i > 0:
+                SEQ = SEQ[overlap(link(G, *path[i-1], node, ori)):]
+            parts.append(SEQ)
+            reads.append(attr.get('LR', ()))
+            LEN += attr.get('LEN', 0); XCov += attr.get('DP', 0) * attr.get('LEN', 0)
+            position[node] = (unitig_id, ori, i)
+        
+        SEQ = ''.join(parts)
+        H.add_node(unitig_id, SEQ=SEQ, LEN=len(SEQ), DP=XCov / LEN if LEN > 0 else 0,
+                   LR=merge_reads(reads), PATH=path)
+    
+    for u, v, attr in G.edges(data=True):
+        U, ori_u, i = position[u]
+        V, ori_v, j = position[v]
+        ori1 = '+' if attr['From'] == ori_u else '-'
+        ori2 = '+' if attr['To'] == ori_v else '-'
+        if U == V and (ori1 == ori2 == '+' and j == i + 1 or ori1 == ori2 == '-' and j == i - 1):
+            continue
+        add_link(H, U, ori1, V, ori2, CIGAR=attr.get('CIGAR', ''))
+    return H